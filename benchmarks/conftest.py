@@ -0,0 +1,95 @@
+"""Inputs of the benchmark suite: the real fixture and synthetic pathbuilders of
+increasing size (see wisskas.synthetic), or the files given with --pathbuilder"""
+
+import logging
+import pathlib
+import tracemalloc
+
+import pytest
+
+from wisskas.synthetic import generate_pathbuilder
+from wisskas.wisski import parse_paths
+
+FIXTURE = (
+    pathlib.Path(__file__).parent.parent / "tests/data/releven_assertions_20240821.xml"
+)
+
+# numbers of root types of the synthetic pathbuilders, with 35 paths each. following all
+# entity references (** filterspecs, exclude endpoints) is exponential in the length of
+# reference chains, so they are acyclic and only few fields are entity references
+SCALES = [10, 100]
+
+
+def synthetic_pathbuilder(root_types: int) -> bytes:
+    return generate_pathbuilder(root_types=root_types, references=0.05, cycles=False)
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path, monkeypatch):
+    """Keep the on-disk pathbuilder and template caches out of the user's home directory"""
+    monkeypatch.setenv("WISSKAS_CACHE_DIR", str(tmp_path / "cache"))
+    # pathbuilder consistency warnings are not of interest here
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--pathbuilder",
+        action="append",
+        default=[],
+        type=pathlib.Path,
+        metavar="FILE",
+        help="run the benchmarks for this pathbuilder definition instead of the fixture and the synthetic ones (can be given several times)",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "pathbuilder" in metafunc.fixturenames:
+        files = metafunc.config.getoption("pathbuilder")
+        metafunc.parametrize(
+            "pathbuilder",
+            files or [FIXTURE, *SCALES],
+            ids=[f.name for f in files]
+            or ["releven", *(f"synthetic-{n}" for n in SCALES)],
+            indirect=True,
+            scope="session",
+        )
+
+
+@pytest.fixture(scope="session")
+def pathbuilder(request) -> bytes:
+    """The XML of a pathbuilder definition, the benchmarks are run for each of them"""
+    if isinstance(request.param, pathlib.Path):
+        return request.param.read_bytes()
+    return synthetic_pathbuilder(request.param)
+
+
+@pytest.fixture(scope="session")
+def nested_paths(pathbuilder):
+    """The root types and paths of the pathbuilder, as returned by parse_paths()"""
+    logging.disable(logging.WARNING)
+    try:
+        return parse_paths(pathbuilder, cache=False)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def memory(benchmark):
+    """Run a function once with tracemalloc and record the peak and retained memory (in
+    bytes) in the benchmark's extra_info, which is part of the JSON results"""
+
+    def measure(fn, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            result = fn(*args, **kwargs)
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["memory_peak"] = peak
+        benchmark.extra_info["memory_retained"] = retained
+        return result
+
+    return measure
@@ -0,0 +1,128 @@
+"""Time and memory benchmarks of the parse, nest, filter and render stages, run for every
+pathbuilder of the `pathbuilder` fixture (see conftest.py).
+
+    uv run pytest benchmarks --benchmark-autosave
+    uv run pytest benchmarks --benchmark-compare --benchmark-compare-fail=min:10%
+
+Results (including the memory figures in extra_info) are saved as JSON in .benchmarks/,
+use --benchmark-json to write them to a file instead.
+"""
+
+import argparse
+
+import pytest
+
+from wisskas.filter import endpoint_exclude_fields, endpoint_include_fields
+from wisskas.generate import generate_endpoint, init_generator
+from wisskas.serialize import serialize_entrypoint, serialize_model, serialize_query
+from wisskas.string_utils import to_classname
+from wisskas.wisski import nest_paths, parse_pathbuilder_paths
+
+# cut off cyclic entity references of the real fixture, this has no effect on the
+# acyclic synthetic pathbuilders
+RECURSION_DEPTH = 0
+
+
+# the options of the endpoints subcommand used by wisskas.generate, with their defaults
+GENERATOR_ARGS = argparse.Namespace(
+    prefix={},
+    everything_optional=False,
+    query_strategy="optional",
+    endpoint_query_strategy={},
+    optimize_queries=True,
+    search_index=False,
+    recursion_depth=RECURSION_DEPTH,
+    max_model_size=None,
+    output_prefix="api/gen",
+)
+
+
+@pytest.fixture(scope="module")
+def endpoints(nested_paths):
+    """A listing endpoint including the direct fields of every root type, generated like
+    by the endpoints subcommand"""
+    root_types, paths = nested_paths
+    init_generator(paths, GENERATOR_ARGS)
+    endpoints = {}
+    for path in root_types.values():
+        endpoint_path = f"/{path.id}"
+        extra = {"orderable": [], "filterable": []}
+        spec = (endpoint_path, path.id, "include", ["*"], None, extra)
+        endpoints[endpoint_path] = generate_endpoint(spec)[0]
+    return endpoints
+
+
+def test_parse_pathbuilder_paths(benchmark, memory, pathbuilder):
+    memory(parse_pathbuilder_paths, pathbuilder, cache=False)
+    benchmark(parse_pathbuilder_paths, pathbuilder, cache=False)
+
+
+def test_nest_paths(benchmark, memory, pathbuilder):
+    # nesting modifies the paths, so every round gets freshly parsed ones
+    def setup():
+        return (parse_pathbuilder_paths(pathbuilder, cache=False),), {}
+
+    memory(nest_paths, parse_pathbuilder_paths(pathbuilder, cache=False))
+    benchmark.pedantic(nest_paths, setup=setup, rounds=10)
+
+
+@pytest.mark.parametrize("filterspec", ["*", "**", "%"])
+def test_endpoint_include_fields(benchmark, memory, nested_paths, filterspec):
+    root_types, _paths = nested_paths
+
+    def include_all():
+        return [
+            endpoint_include_fields(
+                path, [filterspec], to_classname(path.id), None, RECURSION_DEPTH
+            )
+            for path in root_types.values()
+        ]
+
+    memory(include_all)
+    benchmark(include_all)
+
+
+# excluding nothing clones all fields, following all entity references
+@pytest.mark.parametrize("filterspec", ["", "*", "%"])
+def test_endpoint_exclude_fields(benchmark, memory, nested_paths, filterspec):
+    root_types, _paths = nested_paths
+
+    def exclude_all():
+        return [
+            endpoint_exclude_fields(
+                path,
+                [filterspec] if filterspec else [],
+                to_classname(path.id),
+                None,
+                RECURSION_DEPTH,
+            )
+            for path in root_types.values()
+        ]
+
+    memory(exclude_all)
+    benchmark(exclude_all)
+
+
+def test_serialize_model(benchmark, memory, endpoints):
+    def render_all():
+        return [serialize_model(root) for root in endpoints.values()]
+
+    memory(render_all)
+    benchmark(render_all)
+
+
+@pytest.mark.parametrize("optimized", [False, True], ids=["plain", "optimized"])
+def test_serialize_query(benchmark, memory, endpoints, optimized):
+    def render_all():
+        return [
+            serialize_query(root, optimized=optimized) for root in endpoints.values()
+        ]
+
+    memory(render_all)
+    benchmark(render_all)
+
+
+def test_serialize_entrypoint(benchmark, memory, endpoints):
+    args = ("http://localhost:8080/sparql", False, True)
+    memory(serialize_entrypoint, endpoints, *args)
+    benchmark(serialize_entrypoint, endpoints, *args)
@@ -0,0 +1,161 @@
+"""Persistent on-disk cache for parsed pathbuilder definitions.
+
+Entries are keyed by a hash of the pathbuilder XML content and the wisskas version, so
+they are invalidated automatically when either changes. The total size of the cache
+directory is bounded, least recently used entries are evicted first."""
+
+import contextlib
+import hashlib
+import importlib.metadata
+import logging
+import os
+import pathlib
+import pickle
+import tempfile
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# bump whenever the pickled representation of the cached objects changes
+CACHE_FORMAT = 6
+
+# default upper bound for the total size of the cache directory (in bytes)
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+CACHE_SUFFIX = ".pickle"
+
+# what pickle raises for truncated or garbled entries, or ones referring to code that
+# has since been moved or removed
+UNREADABLE_ERRORS = (
+    OSError,
+    EOFError,
+    pickle.UnpicklingError,
+    AttributeError,
+    ImportError,
+    IndexError,
+    TypeError,
+    ValueError,
+)
+
+# what pickle raises for values that can not be serialized
+UNWRITABLE_ERRORS = (
+    OSError,
+    pickle.PicklingError,
+    AttributeError,
+    RecursionError,
+    TypeError,
+)
+
+
+def wisskas_version() -> str:
+    try:
+        return importlib.metadata.version("wisskas")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def cache_dir() -> pathlib.Path:
+    """Return the cache directory: $WISSKAS_CACHE_DIR, or 'wisskas' inside $XDG_CACHE_HOME or ~/.cache"""
+    if "WISSKAS_CACHE_DIR" in os.environ:
+        return pathlib.Path(os.environ["WISSKAS_CACHE_DIR"])
+    return (
+        pathlib.Path(os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache")
+        / "wisskas"
+    )
+
+
+def max_cache_size() -> int:
+    """Return the cache size limit in bytes, can be overridden via $WISSKAS_CACHE_SIZE"""
+    try:
+        return int(os.environ["WISSKAS_CACHE_SIZE"])
+    except KeyError:
+        return DEFAULT_MAX_SIZE
+    except ValueError:
+        logger.warning(
+            f"ignoring invalid $WISSKAS_CACHE_SIZE '{os.environ['WISSKAS_CACHE_SIZE']}', expected a number of bytes"
+        )
+        return DEFAULT_MAX_SIZE
+
+
+def cache_key(xml: pathlib.Path | str | bytes, *variant) -> str:
+    """Hash a pathbuilder file or XML string together with the wisskas version and any parsing options"""
+    digest = hashlib.sha256()
+    if isinstance(xml, pathlib.Path):
+        with open(xml, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+    else:
+        digest.update(xml.encode() if isinstance(xml, str) else xml)
+    digest.update(repr((CACHE_FORMAT, wisskas_version(), *variant)).encode())
+    return digest.hexdigest()
+
+
+def load(key: str) -> Any | None:
+    """Return the object cached under the given key, or None if there is no (valid) entry"""
+    filename = cache_dir() / f"{key}{CACHE_SUFFIX}"
+    try:
+        with open(filename, "rb") as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except UNREADABLE_ERRORS as e:
+        logger.warning(f"discarding unreadable cache entry '{filename}': {e}")
+        filename.unlink(missing_ok=True)
+        return None
+    # mark as recently used for eviction, the entry may have been evicted by a
+    # concurrent wisskas process in the meantime
+    with contextlib.suppress(OSError):
+        os.utime(filename)
+    logger.debug(f"loaded cache entry '{filename}'")
+    return value
+
+
+def store(key: str, value: Any) -> None:
+    """Write an object to the cache and evict old entries if the cache grows too large"""
+    directory = cache_dir()
+    temporary = None
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        # write atomically so concurrent wisskas processes never read partial entries
+        with tempfile.NamedTemporaryFile(
+            dir=directory, suffix=".tmp", delete=False
+        ) as f:
+            temporary = f.name
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, directory / f"{key}{CACHE_SUFFIX}")
+        temporary = None
+    except UNWRITABLE_ERRORS as e:
+        # the cache is an optimization, failing to write it (e.g. because the value
+        # can not be pickled) is never fatal
+        logger.warning(f"failed to write cache entry to '{directory}': {e}")
+        return
+    finally:
+        if temporary is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(temporary)
+    logger.debug(f"stored cache entry '{key}'")
+    evict(max_cache_size())
+
+
+def evict(max_size: int) -> None:
+    """Delete least recently used cache entries until the total size is below max_size"""
+    entries = []
+    for filename in cache_dir().glob(f"*{CACHE_SUFFIX}"):
+        try:
+            stat = filename.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, filename))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, filename in sorted(entries):
+        if total <= max_size:
+            break
+        logger.debug(f"evicting cache entry '{filename}'")
+        filename.unlink(missing_ok=True)
+        total -= size
+
+
+def clear() -> None:
+    """Delete all cache entries"""
+    evict(0)
@@ -6,21 +6,10 @@ from os.path import isfile
 from shutil import copyfile
 from typing import Callable
 
-from rich import print as rprint
-from rich.rule import Rule
-from rich.syntax import Syntax
-
-from wisskas.filter import (
-    DummyRootPath,
-    endpoint_exclude_fields,
-    endpoint_include_fields,
-)
-from wisskas.serialize import serialize_entrypoint, serialize_model, serialize_query
-from wisskas.string_utils import parse_endpointspec, path_to_camelcase, path_to_filename
-from wisskas.wisski import parse_paths
-
 logger = logging.getLogger(__name__)
 
+QUERY_STRATEGIES = ("optional", "union", "auto")
+
 
 def register_subcommand(parser: ArgumentParser) -> Callable:
     parser.add_argument(
@@ -41,6 +30,29 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
         default=False,
     )
 
+    parser.add_argument(
+        "--query-strategy",
+        choices=QUERY_STRATEGIES,
+        help="how to query multi-valued fields: in one OPTIONAL each, which returns the cross product of their values, in the arms of a single UNION, which returns the sum, or automatically based on the expected number of result rows (default: %(default)s)",
+        default="optional",
+    )
+
+    parser.add_argument(
+        "--endpoint-query-strategy",
+        nargs=2,
+        metavar=("/endpoint/path", "strategy"),
+        action="append",
+        help="override the --query-strategy for a single endpoint, use an --endpoint-query-strategy for every endpoint",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--no-query-optimization",
+        dest="optimize_queries",
+        action="store_false",
+        help="write queries exactly as they follow from the endpoint model (default: required patterns are moved ahead of OPTIONALs, redundant patterns removed and OPTIONALs with shared patterns merged)",
+    )
+
     parser.add_argument(
         "-s",
         "--page-size",
@@ -54,7 +66,51 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
         "--timeout",
         nargs="?",
         type=float,
-        help="timeout for the triple store queries (in seconds, default: use httpx AsyncClient default)",
+        help="timeout for the triple store queries made through the shared connection pool, which rdfproxy's synchronous SPARQLModelAdapter does not use (in seconds, default: use httpx AsyncClient default)",
+    )
+
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        metavar="N",
+        help="maximum number of concurrent connections to the triple store, shared by all endpoints that query through the shared connection pool (default: use httpx default of 100)",
+    )
+
+    parser.add_argument(
+        "--max-keepalive-connections",
+        type=int,
+        metavar="N",
+        help="maximum number of idle connections to the triple store that are kept open for reuse (default: use httpx default of 20)",
+    )
+
+    parser.add_argument(
+        "--http2",
+        action="store_true",
+        help="connect to the triple store using HTTP/2 (requires httpx[http2] on the server)",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--recursion-depth",
+        type=int,
+        metavar="N",
+        help="how often entity references that form a cycle are followed before they are cut off and only returned as URIs (default: fail on cyclic references)",
+    )
+
+    parser.add_argument(
+        "--max-model-size",
+        type=int,
+        metavar="N",
+        help="the largest number of fields (including nested ones) of an endpoint model, generating a larger one fails. Following cyclic references --recursion-depth times can result in exponentially many fields (default: 50000)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="number of processes to generate endpoints with. Starting the processes is only worth it for many large endpoints (default: %(default)s)",
+        default=1,
     )
 
     parser.add_argument(
@@ -131,7 +187,13 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
         "-f",
         "--force",
         action="store_true",
-        help="overwrite output files if they already exist on disk (default: exit with an error when an existing file would be overwritten)",
+        help="overwrite output files if they already exist on disk (default: exit with an error when an existing file would be overwritten, unless it was written by a previous run and not modified since, according to the manifest)",
+    )
+
+    file_output.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="regenerate all endpoints (default: only regenerate endpoints whose inputs changed since the last run, according to the manifest file written next to the --output-prefix)",
     )
 
     file_output.add_argument(
@@ -141,6 +203,45 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
         help="also generate FastAPI routes for all endpoints at the --output-prefix location, pointing to the given SPARQL endpoint URL",
     )
 
+    file_output.add_argument(
+        "--inline-queries",
+        action="store_true",
+        help="embed all queries in the generated FastAPI entrypoint (default: the entrypoint loads them from the .rq files at startup)",
+    )
+
+    file_output.add_argument(
+        "--async",
+        dest="async_handlers",
+        action="store_true",
+        help="generate async endpoint functions that run their queries on the event loop (default: synchronous functions, which FastAPI runs in its threadpool)",
+    )
+
+    file_output.add_argument(
+        "--root-id-pagination",
+        action="store_true",
+        help="select the items of listing pages by first querying a page of root ids (using only the patterns every item has to match), then querying the fields of those items only (default: let rdfproxy paginate the full query)",
+    )
+
+    file_output.add_argument(
+        "--keyset-pagination",
+        action="store_true",
+        help="paginate listing endpoints with an opaque cursor instead of page numbers: items are ordered by the sort fields of the endpoint specification and their id, and the next page is selected by a FILTER on the last item's values instead of an OFFSET",
+    )
+
+    file_output.add_argument(
+        "--search-index",
+        action="store_true",
+        help="answer the text queries of filterable listing endpoints from a local full-text index of their filterable fields, which is built by running the generated <output-prefix>_search_index.py (default: filter the query results by the text, which scans all values of the filterable fields)",
+    )
+
+    file_output.add_argument(
+        "--max-batch-size",
+        type=int,
+        metavar="N",
+        help="generate a POST /endpoint/batch variant of every item endpoint, which returns the items for up to N ids (sent as a JSON array) using a single query (default: %(default)s, no batch endpoints)",
+        default=0,
+    )
+
     file_output.add_argument(
         "-c",
         "--counts-endpoint",
@@ -148,6 +249,41 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
         help="generate a /counts endpoint that returns the result count of all generated endpoints",
     )
 
+    file_output.add_argument(
+        "--counts-ttl",
+        type=float,
+        metavar="SECONDS",
+        default=300,
+        help="how long the /counts endpoint caches the result counts before querying them again (default: %(default)s)",
+    )
+
+    file_output.add_argument(
+        "--no-coalesce",
+        dest="coalesce",
+        action="store_false",
+        help="do not coalesce identical concurrent requests (default: concurrent requests with the same endpoint and parameters share one triple store query, see /metrics/coalescing)",
+    )
+
+    file_output.add_argument(
+        "--cache-ttl",
+        type=float,
+        metavar="SECONDS",
+        help="cache the responses of all endpoints in the FastAPI app for this long, and add a POST /cache/flush route to drop them, which requires the token in $CACHE_FLUSH_TOKEN on the server (default: no caching)",
+    )
+
+    file_output.add_argument(
+        "--cache-size",
+        type=int,
+        metavar="N",
+        help="maximum number of cached responses, the least recently used ones are dropped first (default: 1024)",
+    )
+
+    file_output.add_argument(
+        "--cache-backend",
+        metavar="module:class",
+        help="class to cache responses with instead of the built-in in-process cache, it is called with size and ttl keyword arguments and has to provide get(key), set(key, response) and clear() methods (which are run in a worker thread, so they may block)",
+    )
+
     file_output.add_argument(
         "--cors",
         nargs="*",
@@ -173,9 +309,37 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
 
 
 def main(args):
-    _root_types, paths = parse_paths(args.input)
+    # imported here so that registering the subcommand does not load lxml, jinja2 and rich
+    from rich import print as rprint
+    from rich.rule import Rule
+    from rich.syntax import Syntax
+
+    from wisskas import manifest
+    from wisskas.filter import MAX_MODEL_PATHS, DummyRootPath
+    from wisskas.generate import generate_endpoints, get_prefixed_filename
+    from wisskas.serialize import serialize_entrypoint, serialize_search_index
+    from wisskas.string_utils import parse_endpointspec, path_to_filename
+    from wisskas.wisski import parse_paths
+
+    _root_types, paths = parse_paths(args.input, cache=args.cache)
     args.prefix = dict(args.prefix)
+    if args.max_model_size is None:
+        args.max_model_size = MAX_MODEL_PATHS
+    args.endpoint_query_strategy = dict(args.endpoint_query_strategy)
+    for path, strategy in args.endpoint_query_strategy.items():
+        if strategy not in QUERY_STRATEGIES:
+            raise RuntimeError(
+                f"invalid query strategy '{strategy}' for endpoint {path}, expected one of: {', '.join(QUERY_STRATEGIES)}"
+            )
+    if args.jobs < 1:
+        raise RuntimeError(f"--jobs must be at least 1, got {args.jobs}")
+    if args.cache_backend and len(args.cache_backend.split(":")) != 2:
+        raise RuntimeError(
+            f"--cache-backend must have the form module:class, got '{args.cache_backend}'"
+        )
     endpoints = {}
+    # (endpoint_path, path_id, include/exclude, filters, key_field, extra) tuples
+    specs = []
 
     # TODO sanitize last elemenet of output_prefix (if any): no hyphens...
     # https://python.land/courses/intermediate-python-course/lessons/modules-and-the-import-statement/topic/valid-modules-names
@@ -188,79 +352,56 @@ def main(args):
             )
         endpoints[endpoint_path] = endpoint
 
+    def add_spec(path_id, task, filters, key_field=None):
+        path_id, endpoint_path, extra = parse_endpointspec(path_id)
+        if path_id not in paths:
+            raise RuntimeError(f"no path with id '{path_id}' in the pathbuilder")
+        # reserve the endpoint path, the endpoint itself is generated below
+        add_endpoint(endpoint_path, None)
+        specs.append((endpoint_path, path_id, task, filters, key_field, extra))
+
     for path_id, *filters in args.listing_include_fields:
         if len(filters) == 0:
             raise Exception(
                 f"endpoint '{path_id}' is defined using --listing-include-fields but is missing any fields to include"
             )
-        path_id, endpoint_path, extra = parse_endpointspec(path_id)
-
-        add_endpoint(
-            endpoint_path,
-            endpoint_include_fields(
-                paths[path_id],
-                filters,
-                path_to_camelcase(endpoint_path),
-            ),
-        )
-        endpoints[endpoint_path].orderable_fields = extra["orderable"]
-        endpoints[endpoint_path].filterable_fields = extra["filterable"]
+        add_spec(path_id, "include", filters)
 
     for path_id, key_field, *filters in args.item_include_fields:
         if len(filters) == 0:
             raise Exception(
                 f"endpoint '{path_id}' is defined using --item-include-fields but is missing any fields to include"
             )
-        path_id, endpoint_path, extra = parse_endpointspec(path_id)
-
-        add_endpoint(
-            endpoint_path,
-            endpoint_include_fields(
-                paths[path_id],
-                filters,
-                path_to_camelcase(endpoint_path),
-            ),
-        )
-        endpoints[endpoint_path].key_field = key_field
-        endpoints[endpoint_path].orderable_fields = extra["orderable"]
-        endpoints[endpoint_path].filterable_fields = extra["filterable"]
+        add_spec(path_id, "include", filters, key_field)
 
     for path_id, *filters in args.listing_exclude_fields:
-        path_id, endpoint_path, extra = parse_endpointspec(path_id)
-
-        add_endpoint(
-            endpoint_path,
-            endpoint_exclude_fields(
-                paths[path_id],
-                filters,
-                path_to_camelcase(endpoint_path),
-            ),
-        )
-        endpoints[endpoint_path].orderable_fields = extra["orderable"]
-        endpoints[endpoint_path].filterable_fields = extra["filterable"]
+        add_spec(path_id, "exclude", filters)
 
     for path_id, key_field, *filters in args.item_exclude_fields:
-        path_id, endpoint_path, extra = parse_endpointspec(path_id)
-
-        add_endpoint(
-            endpoint_path,
-            endpoint_exclude_fields(
-                paths[path_id],
-                filters,
-                path_to_camelcase(endpoint_path),
-            ),
-        )
-        endpoints[endpoint_path].key_field = key_field
-        endpoints[endpoint_path].orderable_fields = extra["orderable"]
-        endpoints[endpoint_path].filterable_fields = extra["filterable"]
+        add_spec(path_id, "exclude", filters, key_field)
 
     def print_code(code, language="python"):
         rprint(Syntax(code, language, theme=args.color_theme), "\n")
 
+    # files written by a previous run, and by this one
+    previous = (
+        manifest.load(args.output_prefix)
+        if args.output_prefix and not args.rebuild
+        else manifest.empty_manifest()
+    )
+    current = manifest.empty_manifest()
+    current["page_size"] = args.page_size
+
     def dump_to_file(content, filename):
+        current["files"][filename] = manifest.content_hash(content)
+        if manifest.file_hash(filename) == current["files"][filename]:
+            logger.info(f"'{filename}' is unchanged")
+            return
         logger.info(f"writing '{filename}'")
         try:
-            with open(filename, "w" if args.force else "x") as f:
+            # files from the previous run can be replaced unless they were modified since
+            overwrite = args.force or manifest.unchanged(previous, [filename])
+            with open(filename, "w" if overwrite else "x") as f:
                 f.write(content)
         except FileExistsError:
             logger.error(
@@ -268,30 +409,87 @@ def main(args):
             )
             sys.exit(1)
 
-    def get_prefixed_filename(path):
-        return f"{args.output_prefix}_{path_to_filename(path)}"
-
-    for path, root in endpoints.items():
-        filename = get_prefixed_filename(path)
+    # only regenerate endpoints whose inputs or output files changed
+    hashes = {}
+    pending = []
+    for spec in specs:
+        path, path_id = spec[:2]
+        if not args.output_prefix:
+            pending.append(spec)
+            continue
+        hashes[path] = manifest.endpoint_hash(
+            paths[path_id],
+            spec,
+            args.prefix,
+            args.everything_optional,
+            args.endpoint_query_strategy.get(path, args.query_strategy),
+            args.optimize_queries,
+            args.search_index,
+            args.recursion_depth,
+            args.output_prefix,
+        )
+        entry = previous["endpoints"].get(path)
+        if (
+            entry
+            and entry["hash"] == hashes[path]
+            and manifest.unchanged(previous, entry["files"])
+        ):
+            endpoints[path] = manifest.entry_endpoint(entry)
+            current["endpoints"][path] = entry
+            for filename in entry["files"]:
+                current["files"][filename] = previous["files"][filename]
+        else:
+            pending.append(spec)
 
-        # this is the local filename
-        root.filename = filename.rsplit("/", 1)[-1]
-        if hasattr(root, "key_field"):
-            root.item_key = root.key_field
-        root.everything_optional = args.everything_optional
+    if len(pending) < len(specs):
+        logger.info(
+            f"skipping {len(specs) - len(pending)} unchanged endpoints: {', '.join(path for path in current['endpoints'])}"
+        )
 
-        model = serialize_model(root)
-        query = serialize_query(root, args.prefix)
+    # query source code by endpoint filename, for inlining into the entrypoint
+    queries = {}
+
+    def read_query(path, filename_prefix):
+        if args.inline_queries:
+            with open(f"{filename_prefix}.rq") as f:
+                queries[endpoints[path].filename] = f.read()
+
+    for path in current["endpoints"]:
+        read_query(path, get_prefixed_filename(args, path))
+
+    reused = cloned = 0
+    # results are generated in parallel but written in order, so the output does not
+    # depend on the number of jobs
+    for spec, (root, model, query, hits, misses) in zip(
+        pending, generate_endpoints(pending, paths, args)
+    ):
+        path = spec[0]
+        endpoints[path] = root
+        queries[root.filename] = query
+        reused += hits
+        cloned += hits + misses
 
         if args.output_prefix:
+            filename = get_prefixed_filename(args, path)
             dump_to_file(model, f"{filename}.py")
             dump_to_file(query, f"{filename}.rq")
+            current["endpoints"][path] = manifest.endpoint_entry(
+                root, hashes[path], [f"{filename}.py", f"{filename}.rq"]
+            )
 
         else:
             rprint(Rule(path))
             print_code(model)
             print_code(query, "sparql")
 
+    if pending:
+        logger.info(f"clone cache: {reused} of {cloned} cloned subtrees were reused")
+
+    for path in previous["endpoints"].keys() - current["endpoints"].keys():
+        logger.info(
+            f"endpoint '{path}' is not generated anymore, its files were left in place"
+        )
+
     suffixes = ["py", "rq"]
 
     def check_files_exist(prefix):
@@ -305,7 +503,7 @@ def main(args):
 
     def copy_manual_endpoint_files(prefix: str, path: str):
         """Copy the file and return the (last element of the) target filename"""
-        target = get_prefixed_filename(path_to_filename(path))
+        target = get_prefixed_filename(args, path_to_filename(path))
         for suffix in suffixes:
             source = f"{prefix}.{suffix}"
             filetarget = f"{target}.{suffix}"
@@ -318,6 +516,7 @@ def main(args):
             add_endpoint(path, DummyRootPath(modelname))
             endpoints[path].key_field = id_field
             endpoints[path].filename = copy_manual_endpoint_files(filename_prefix, path)
+            read_query(path, filename_prefix)
         else:
             logger.warning(f"skipping manually defined item endpoint {path}")
 
@@ -325,10 +524,20 @@ def main(args):
         if check_files_exist(filename_prefix):
             add_endpoint(path, DummyRootPath(modelname))
             endpoints[path].filename = copy_manual_endpoint_files(filename_prefix, path)
+            read_query(path, filename_prefix)
             # TODO parse orderable_fields and filterable_fields
         else:
             logger.warning(f"skipping manually defined listing endpoint {path}")
 
+    httpx_args = {"timeout": args.timeout} if args.timeout else None
+
+    # the module of the search index, if any endpoint uses it
+    search = None
+    if args.search_index and any(
+        getattr(endpoint, "search_queries", None) for endpoint in endpoints.values()
+    ):
+        search = f"{pathlib.Path(args.output_prefix).name}_search_index"
+
     entrypoint = serialize_entrypoint(
         endpoints,
         args.server_address,
@@ -336,8 +545,26 @@ def main(args):
         args.counts_endpoint,
         {"origins": args.cors},
         args.page_size,
-        {"timeout": args.timeout} if args.timeout else None,
+        httpx_args,
         30 - 10 * args.logging,
+        queries if args.inline_queries else None,
+        {
+            "max_connections": args.max_connections,
+            "max_keepalive_connections": args.max_keepalive_connections,
+            "http2": args.http2,
+        },
+        args.async_handlers,
+        args.counts_ttl,
+        {
+            "ttl": args.cache_ttl,
+            "size": args.cache_size,
+            "backend": args.cache_backend,
+        },
+        args.coalesce,
+        args.root_id_pagination,
+        args.keyset_pagination,
+        args.max_batch_size,
+        search,
     )
 
     if args.server_address:
@@ -346,3 +573,16 @@ def main(args):
         else:
             rprint(Rule("FastAPI entry point"))
             print_code(entrypoint)
+
+    if args.server_address and search:
+        search_index = serialize_search_index(
+            endpoints, args.server_address, httpx_args
+        )
+        if args.output_prefix:
+            dump_to_file(search_index, f"{args.output_prefix}_search_index.py")
+        else:
+            rprint(Rule("search index"))
+            print_code(search_index)
+
+    if args.output_prefix:
+        manifest.store(args.output_prefix, current)
@@ -0,0 +1,81 @@
+import logging
+from argparse import ArgumentParser
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def register_subcommand(parser: ArgumentParser) -> Callable:
+    parser.add_argument(
+        "endpoint",
+        metavar="/endpoint/path",
+        help="the path of the listing endpoint to export",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-prefix",
+        required=True,
+        help="the --output-prefix the endpoint was generated with by `wisskas endpoints`",
+    )
+    parser.add_argument(
+        "-a",
+        "--server-address",
+        metavar="sparql_api_url",
+        required=True,
+        help="the SPARQL endpoint URL to query",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        help="write the items to this file, one JSON object per line (default: stdout)",
+    )
+    parser.add_argument(
+        "-s",
+        "--page-size",
+        type=int,
+        help="number of items to query at a time (default: %(default)s)",
+        default=1000,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="maximum number of pages to query concurrently (default: %(default)s)",
+        default=4,
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        help="timeout for the triple store queries (in seconds, default: use httpx AsyncClient default)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted export to the --file after its last completed page (default: start over)",
+    )
+    return main
+
+
+def main(args):
+    # imported here so that registering the subcommand does not load rdfproxy
+    import asyncio
+
+    from wisskas.export import export
+
+    if args.page_size < 1 or args.jobs < 1:
+        raise RuntimeError("--page-size and --jobs must be at least 1")
+    pages = asyncio.run(
+        export(
+            args.output_prefix,
+            args.endpoint,
+            args.server_address,
+            args.file,
+            args.page_size,
+            args.jobs,
+            args.resume,
+            {"timeout": args.timeout} if args.timeout else None,
+        )
+    )
+    logger.info(f"exported {pages} pages of {args.endpoint}")
@@ -2,12 +2,6 @@ import logging
 from argparse import ArgumentParser
 from typing import Callable
 
-from lxml import etree
-from rich import print
-from rich.syntax import Syntax
-
-from wisskas.wisski import parse_pathbuilder_paths
-
 logger = logging.getLogger(__name__)
 
 
@@ -33,14 +27,23 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
 
 
 def main(args):
-    paths = parse_pathbuilder_paths(args.input, include_disabled=True)
+    # imported here so that registering the subcommand does not load lxml and rich
+    from lxml import etree
+    from rich import print
+    from rich.syntax import Syntax
+
+    from wisskas.wisski import parse_pathbuilder_paths
+
+    paths = parse_pathbuilder_paths(
+        args.input, include_disabled=True, cache=args.cache, keep_xml=True
+    )
     filters = [clause.split("=", 1) for clause in args.filter]
     # TODO check for invalid filter specs instead of letting it crash/fail silently?
 
     filtered_paths = []
     for path in paths.values():
         for clause in filters:
-            if path.xml[clause[0]].text == clause[1]:
+            if path.xml.findtext(clause[0]) == clause[1]:
                 logger.info(f"including path {path.id}")
                 filtered_paths.append(path)
                 break  # one level
@@ -54,7 +57,7 @@ def main(args):
             "validating filtered pathbuilder definition by running it through the parser:"
         )
         # emits logger messages if something is wrong
-        parse_pathbuilder_paths(etree.tostring(root))
+        parse_pathbuilder_paths(etree.tostring(root), cache=False)
 
     if args.output:
         print(f"Writing {len(filtered_paths)} paths to {args.output}")
@@ -4,16 +4,25 @@ import logging
 import pathlib
 from typing import Callable
 
-from rich.logging import RichHandler
-from rich_argparse import RichHelpFormatter
-
 from wisskas.cli.endpoints import register_subcommand as endpoints_args
+from wisskas.cli.export import register_subcommand as export_args
 from wisskas.cli.filter import register_subcommand as filter_args
 from wisskas.cli.paths import register_subcommand as paths_args
+from wisskas.cli.snapshot import register_subcommand as snapshot_args
+
+
+def rich_help_formatter(prog: str) -> argparse.HelpFormatter:
+    # rich is only imported when help or usage messages are actually printed
+    from rich_argparse import RichHelpFormatter
+
+    return RichHelpFormatter(prog)
 
 
 def main(args=None):
-    parser = argparse.ArgumentParser(formatter_class=RichHelpFormatter)
+    # argparse instantiates the formatter for every argument definition, so the plain
+    # formatter is used while setting up the parsers and replaced afterwards
+    parser = argparse.ArgumentParser()
+    parsers = [parser]
     parser.add_argument(
         "input",
         type=pathlib.Path,
@@ -26,11 +35,8 @@ def main(args=None):
     )
 
     def add_command(command: str, add_subcommand_args: Callable, **kwargs):
-        subparser = subparsers.add_parser(
-            command,
-            formatter_class=RichHelpFormatter,
-            **kwargs,
-        )
+        subparser = subparsers.add_parser(command, **kwargs)
+        parsers.append(subparser)
         command_main = add_subcommand_args(subparser)
         # TODO check if a callable was returned
         subparser.set_defaults(func=command_main)
@@ -42,8 +48,18 @@ def main(args=None):
         endpoints_args,
         help="generate models, queries and FastAPI endpoints to be used with rdfproxy",
     )
+    add_command(
+        "export",
+        export_args,
+        help="export all items of a generated listing endpoint as JSON Lines",
+    )
     add_command("filter", filter_args, help="create a filtered pathbuilder file")
     add_command("paths", paths_args, help="inspect pathbuilder definitions")
+    add_command(
+        "snapshot",
+        snapshot_args,
+        help="write the responses of all generated endpoints as a static file tree",
+    )
 
     cli_output = parser.add_argument_group(
         "CLI options",
@@ -61,13 +77,33 @@ def main(args=None):
         help="Increase the verbosity of the logging output: default is INFO, use -v DEBUG",
     )
 
+    cli_output.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="always re-parse the pathbuilder instead of using the on-disk cache of parsed pathbuilders (location: $WISSKAS_CACHE_DIR or ~/.cache/wisskas)",
+    )
+
+    for p in parsers:
+        p.formatter_class = rich_help_formatter
+
     args = parser.parse_args(args)
 
+    from rich.console import Console
+    from rich.logging import RichHandler
+
     logging.basicConfig(
         level=10 if args.verbose else 20,
         datefmt=" ",
         format="%(name)s: %(message)s" if args.verbose else "%(message)s",
-        handlers=[RichHandler(rich_tracebacks=True, show_path=args.verbose)],
+        # log to stderr, so output written to stdout (like exports) can be piped
+        handlers=[
+            RichHandler(
+                console=Console(stderr=True),
+                rich_tracebacks=True,
+                show_path=args.verbose,
+            )
+        ],
     )
 
     logger = logging.getLogger(__name__)
@@ -1,12 +1,6 @@
 from argparse import ArgumentParser
 from typing import Callable
 
-from rich import print as rprint
-from rich.rule import Rule
-from rich.tree import Tree
-
-from wisskas.wisski import parse_pathbuilder_paths, parse_paths
-
 
 def register_subcommand(parser: ArgumentParser) -> Callable:
     parser.set_defaults(func=main)
@@ -28,18 +22,35 @@ def register_subcommand(parser: ArgumentParser) -> Callable:
 
 
 def main(args):
+    # imported here so that registering the subcommand does not load lxml and rich
+    from lxml import etree
+    from rich import print as rprint
+    from rich.rule import Rule
+    from rich.syntax import Syntax
+    from rich.tree import Tree
+
+    from wisskas.wisski import parse_pathbuilder_paths, parse_paths
+
     def file_rule(msg):
         return Rule(f"{args.input.name}: {msg}")
 
     if args.flat:
-        paths = parse_pathbuilder_paths(args.input)
+        paths = parse_pathbuilder_paths(args.input, cache=args.cache, keep_xml=True)
 
         if args.all:
             args.path_id = sorted(paths.keys())
 
         if args.path_id:
             for path_id in args.path_id:
-                rprint(paths[path_id].xml)
+                rprint(
+                    Syntax(
+                        etree.tostring(
+                            paths[path_id].xml, pretty_print=True, encoding="unicode"
+                        ),
+                        "xml",
+                        theme=args.color_theme,
+                    )
+                )
         else:
             for path in paths:
                 rprint(f"- {path}")
@@ -47,7 +58,7 @@ def main(args):
         rprint(file_rule(f"{len(paths)} paths"))
 
     elif args.nested:
-        root_types, paths = parse_paths(args.input)
+        root_types, paths = parse_paths(args.input, cache=args.cache)
 
         if args.all:
             args.path_id = sorted(path.id for path in root_types.values())
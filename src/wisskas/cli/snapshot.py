@@ -0,0 +1,71 @@
+import logging
+from argparse import ArgumentParser
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def register_subcommand(parser: ArgumentParser) -> Callable:
+    parser.add_argument(
+        "-o",
+        "--output-prefix",
+        required=True,
+        help="the --output-prefix the endpoints were generated with by `wisskas endpoints`",
+    )
+    parser.add_argument(
+        "-a",
+        "--server-address",
+        metavar="sparql_api_url",
+        required=True,
+        help="the SPARQL endpoint URL to query",
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        required=True,
+        help="the directory to write the snapshot to (updating a previous snapshot in it)",
+    )
+    parser.add_argument(
+        "-s",
+        "--page-size",
+        type=int,
+        help="number of items per page of the listing endpoints, and of items queried at a time from item endpoints (default: the --page-size the endpoints were generated with)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="maximum number of queries to run concurrently (default: %(default)s)",
+        default=4,
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        help="timeout for the triple store queries (in seconds, default: use httpx AsyncClient default)",
+    )
+    return main
+
+
+def main(args):
+    # imported here so that registering the subcommand does not load rdfproxy
+    import asyncio
+
+    from wisskas.snapshot import snapshot
+
+    if (args.page_size is not None and args.page_size < 1) or args.jobs < 1:
+        raise RuntimeError("--page-size and --jobs must be at least 1")
+    files, written, removed = asyncio.run(
+        snapshot(
+            args.output_prefix,
+            args.server_address,
+            args.directory,
+            args.page_size,
+            args.jobs,
+            {"timeout": args.timeout} if args.timeout else None,
+        )
+    )
+    logger.info(
+        f"snapshot of {files} files in '{args.directory}': {written} written, {files - written} unchanged, {removed} removed"
+    )
@@ -0,0 +1,246 @@
+"""Bulk export of listing endpoints as JSON Lines (NDJSON), using the models and queries
+written by `wisskas endpoints`.
+
+The roots of an endpoint are paginated by their id: every page of ids is selected with
+the endpoint's ids query, and the items of those ids are then queried by binding them in
+a VALUES block. Pages are queried concurrently, but written in order, and no more than
+`jobs` pages are held in memory at a time. After every written page, the position in the
+output file and the next page are recorded in a progress file next to it, so an
+interrupted export can be resumed from the last completed page."""
+
+import asyncio
+import contextlib
+import importlib.util
+import json
+import logging
+import math
+import os
+import pathlib
+import re
+import sys
+import tempfile
+
+import httpx
+from rdflib import URIRef
+from rdfproxy import SPARQLWrapper
+from rdfproxy.mapper import _ModelBindingsMapper
+from rdfproxy.utils.sparql_utils import get_query_projection
+
+from wisskas import manifest
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_SUFFIX = ".progress.json"
+
+
+def load_model(output_prefix: str, endpoint: dict) -> tuple[type, str]:
+    """Return the model and query of a generated endpoint, given its manifest entry"""
+    directory = pathlib.Path(output_prefix).parent
+    spec = importlib.util.spec_from_file_location(
+        endpoint["filename"], directory / f"{endpoint['filename']}.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    with open(directory / f"{endpoint['filename']}.rq") as f:
+        query = f.read()
+    return getattr(module, endpoint["class_name"]), query
+
+
+def load_endpoint(output_prefix: str, path: str) -> tuple[type, str, str, str]:
+    """Return the model, query, ids query and count query of a generated listing
+    endpoint"""
+    entry = manifest.load(output_prefix)["endpoints"].get(path)
+    if entry is None:
+        raise RuntimeError(
+            f"no endpoint {path} in the manifest of '{output_prefix}', generate it with `wisskas endpoints -o {output_prefix}` first"
+        )
+    endpoint = entry["endpoint"]
+    if endpoint["item_key"]:
+        raise RuntimeError(f"{path} is an item endpoint, only listings can be exported")
+    return (
+        *load_model(output_prefix, endpoint),
+        endpoint["ids_query"],
+        endpoint["count_query"],
+    )
+
+
+def insert_values(query: str, variable: str, ids: list[str]) -> str:
+    """Bind variable to the given IRIs at the start of the query pattern"""
+    values = " ".join(URIRef(id).n3() for id in ids)
+    where = re.search(r"\bwhere\s*{", query, flags=re.IGNORECASE).end()
+    return f"{query[:where]} VALUES ?{variable} {{ {values} }} {query[where:]}"
+
+
+class Exporter:
+    """Queries the pages of a listing endpoint and serializes their items. Without an
+    ids query (as for item endpoints), only the bindings of queries are available"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        target: str,
+        model: type,
+        query: str,
+        ids_query: str | None,
+        page_size: int,
+    ):
+        self.client = client
+        self.target = target
+        self.model = model
+        self.query = query
+        self.ids_query = ids_query
+        # the ids query of listings projects the same root binding as the query
+        self.root = str(get_query_projection(ids_query or query)[0])
+        self.page_size = page_size
+
+    async def bindings(self, query: str):
+        response = await self.client.post(
+            self.target,
+            data={"output": "json", "query": query},
+            headers={"Accept": "application/sparql-results+json"},
+        )
+        return SPARQLWrapper._get_bindings_from_json_response(
+            response.raise_for_status().json()
+        )
+
+    async def count(self, count_query: str) -> int:
+        return int(next(await self.bindings(count_query))["cnt"])
+
+    async def models(self, page: int) -> list:
+        """Return the items of a page, ordered by their id"""
+        ids = [
+            str(row[self.root])
+            for row in await self.bindings(
+                f"{self.ids_query} ORDER BY STR(?{self.root}) "
+                f"LIMIT {self.page_size} OFFSET {page * self.page_size}"
+            )
+        ]
+        if not ids:
+            return []
+        rows = {}
+        for row in await self.bindings(insert_values(self.query, self.root, ids)):
+            rows.setdefault(str(row[self.root]), []).append(row)
+        return [
+            model
+            for id in ids
+            if id in rows
+            for model in _ModelBindingsMapper(self.model, rows[id]).get_models()
+        ]
+
+    async def page(self, page: int) -> str:
+        """Return the items of a page, serialized as JSON lines"""
+        return "".join(
+            model.model_dump_json() + "\n" for model in await self.models(page)
+        )
+
+
+def progress_filename(output: str) -> pathlib.Path:
+    return pathlib.Path(f"{output}{PROGRESS_SUFFIX}")
+
+
+def load_progress(output: str, path: str, page_size: int) -> dict:
+    """Return the progress of a previous export to output, to resume it"""
+    try:
+        with open(progress_filename(output)) as f:
+            progress = json.load(f)
+    except FileNotFoundError:
+        return {"page": 0, "offset": 0}
+    if progress.get("endpoint") != path or progress.get("page_size") != page_size:
+        raise RuntimeError(
+            f"'{output}' is an export of {progress.get('endpoint')} with page size {progress.get('page_size')}, cannot resume it with different settings"
+        )
+    return progress
+
+
+def store_progress(output: str, progress: dict) -> None:
+    filename = progress_filename(output)
+    # write atomically, so an interrupted export never leaves a truncated progress file
+    with tempfile.NamedTemporaryFile(
+        "w", dir=filename.parent, suffix=".tmp", delete=False
+    ) as f:
+        json.dump(progress, f)
+    os.replace(f.name, filename)
+
+
+@contextlib.asynccontextmanager
+async def open_output(output: str | None, offset: int):
+    """Open the output file (or stdout) for writing at offset, dropping anything written
+    after it (the rest of an incomplete page)"""
+    if output is None:
+        yield sys.stdout.buffer
+        return
+    out = await asyncio.to_thread(open, output, "r+b" if offset else "wb")
+    try:
+        await asyncio.to_thread(out.truncate, offset)
+        out.seek(offset)
+        yield out
+    finally:
+        await asyncio.to_thread(out.close)
+
+
+def write_page(out, content: str, output: str | None, progress: dict) -> None:
+    """Write the items of a page and record the position after them in the progress
+    file. This blocks on file I/O, so export() runs it in a worker thread"""
+    out.write(content.encode())
+    out.flush()
+    if output is not None:
+        progress["offset"] = out.tell()
+        store_progress(output, progress)
+
+
+async def export(
+    output_prefix: str,
+    path: str,
+    target: str,
+    output: str | None = None,
+    page_size: int = 1000,
+    jobs: int = 4,
+    resume: bool = False,
+    httpx_args: dict | None = None,
+) -> int:
+    """Export all items of a listing endpoint to the output file (or stdout), return the
+    number of written pages"""
+    model, query, ids_query, count_query = load_endpoint(output_prefix, path)
+    if output is None and resume:
+        raise RuntimeError("only exports to a file can be resumed")
+    progress = (
+        await asyncio.to_thread(load_progress, output, path, page_size)
+        if resume and output
+        else {"page": 0, "offset": 0}
+    )
+    progress.update({"endpoint": path, "page_size": page_size})
+
+    async with httpx.AsyncClient(**(httpx_args or {})) as client:
+        exporter = Exporter(client, target, model, query, ids_query, page_size)
+        total = await exporter.count(count_query)
+        pages = math.ceil(total / page_size)
+        logger.info(
+            f"exporting {total} items of {path} in {pages} pages of {page_size}"
+            + (f", resuming at page {progress['page'] + 1}" if progress["page"] else "")
+        )
+
+        start = progress["page"]
+        # pages are queried concurrently, but at most jobs pages ahead of the last
+        # written one
+        queue = {}
+        async with open_output(output, progress["offset"]) as out:
+            try:
+                for page in range(start, pages):
+                    for ahead in range(page, min(page + jobs, pages)):
+                        if ahead not in queue:
+                            queue[ahead] = asyncio.ensure_future(exporter.page(ahead))
+                    content = await queue.pop(page)
+                    progress["page"] = page + 1
+                    await asyncio.to_thread(write_page, out, content, output, progress)
+                    logger.debug(f"wrote page {page + 1} of {pages}")
+            finally:
+                # the pages queried ahead are not needed anymore, but must not outlive
+                # the client
+                for task in queue.values():
+                    task.cancel()
+                await asyncio.gather(*queue.values(), return_exceptions=True)
+
+    # a completed export has nothing to resume
+    if output is not None:
+        await asyncio.to_thread(progress_filename(output).unlink, missing_ok=True)
+    return pages - start
@@ -1,5 +1,6 @@
 import copy
 import logging
+from collections import Counter
 
 from wisskas.string_utils import (
     FILTER_PATH_SEPARATOR,
@@ -11,6 +12,11 @@ from wisskas.wisski import WISSKI_TYPES, WissKIPath
 
 logger = logging.getLogger(__name__)
 
+# the largest number of paths (fields, including nested ones) an endpoint model may have.
+# following cyclic entity references recursion_depth times can unroll into exponentially
+# many fields, which are too many to render long before they use up all memory
+MAX_MODEL_PATHS = 50_000
+
 
 class DummyRootPath(WissKIPath):
     def __init__(
@@ -18,16 +24,132 @@ class DummyRootPath(WissKIPath):
         root_classname,
         root=None,
     ):
-        self.path_array = []
+        self.path_array = ()
         self.binding_vars = []
         self.fields = {root_classname: root}
         self.class_name = root_classname
 
 
+class CloneCache:
+    """Memoizes cloned subtrees, so identical subtrees are only computed once per run.
+
+    The names of binding variables and (entity reference) classes of a cloned subtree are
+    derived from the names of its parent by string concatenation, everything else only
+    depends on the path structure. Cached subtrees are therefore keyed by the cloned path
+    id, the normalized filterspec, whether entity references are resolved, and the shape of
+    the clone's path relative to its parent, and rebased onto the names of the parent
+    they are reused for."""
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(task, parent, fieldname, filterspec, resolve_entity_references):
+        path = parent.fields[fieldname]
+        path_array, inherited_vars = clone_path_array(parent, path)
+        return (
+            task,
+            path.id,
+            normalize_filterspec(filterspec),
+            resolve_entity_references,
+            path_array,
+            inherited_vars,
+        )
+
+    def lookup(self, key, parent, groups) -> tuple[WissKIPath, set[str]] | None:
+        """Return a cached subtree rebased onto parent and the entity reference targets
+        resolved within it. Subtrees that resolve references to any of the groups which are
+        currently being cloned are not reused, since they would form a cycle there"""
+        try:
+            clone, old_binding_vars, old_class_name, refs = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        if any(groups[ref] for ref in refs):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (
+            rebase_clone(
+                clone,
+                old_binding_vars,
+                old_class_name,
+                parent.binding_vars[-key[-1] :],
+                parent.class_name,
+            ),
+            refs,
+        )
+
+    def store(self, key, parent, clone, refs):
+        self.entries[key] = (
+            clone,
+            parent.binding_vars[-key[-1] :],
+            parent.class_name,
+            refs,
+        )
+
+
+def normalize_filterspec(filterspec) -> tuple[str, ...]:
+    if isinstance(filterspec, PathElement):
+        # leaf marker, including its count/distinct suffixes
+        return filterspec.__reduce__()[1]
+    return tuple(sorted(set(filterspec)))
+
+
+def rebase_clone(
+    clone: WissKIPath,
+    old_binding_vars: list[str],
+    old_class_name: str,
+    new_binding_vars: list[str],
+    new_class_name: str,
+) -> WissKIPath:
+    """Return a copy of a cloned subtree with all binding variable and class names that
+    were inherited or derived from its old parent's names replaced by the new parent's"""
+    if old_binding_vars == new_binding_vars and old_class_name == new_class_name:
+        # identical context, the subtree can be shared
+        return clone
+
+    renamed = dict(zip(old_binding_vars, new_binding_vars))
+    old_prefix, new_prefix = f"{old_binding_vars[-1]}_", f"{new_binding_vars[-1]}_"
+    old_class_prefix, new_class_prefix = f"{old_class_name}_", f"{new_class_name}_"
+
+    def rename(name):
+        if name in renamed:
+            return renamed[name]
+        if name.startswith(old_prefix):
+            return new_prefix + name[len(old_prefix) :]
+        return name
+
+    def rebase(path):
+        rebased = copy.copy(path)
+        rebased.binding_vars = [rename(var) for var in path.binding_vars]
+        rebased.binding = rename(path.binding)
+        # classes of resolved entity references are named after their parent class
+        if path.class_name and path.class_name.startswith(old_class_prefix):
+            rebased.class_name = (
+                new_class_prefix + path.class_name[len(old_class_prefix) :]
+            )
+        return rebased
+
+    # iterative, subtrees can be nested deeper than the recursion limit
+    root = rebase(clone)
+    stack = [root]
+    while stack:
+        rebased = stack.pop()
+        rebased.fields = {name: rebase(f) for name, f in rebased.fields.items()}
+        stack.extend(rebased.fields.values())
+    return root
+
+
 def endpoint_exclude_fields(
     root,
     exclude,
     root_classname,
+    clone_cache=None,
+    recursion_depth=None,
+    max_paths=MAX_MODEL_PATHS,
 ):
     return clone_exclude(
         DummyRootPath(
@@ -36,6 +158,9 @@ def endpoint_exclude_fields(
         ),
         root_classname,
         exclude,
+        clone_cache=CloneCache() if clone_cache is None else clone_cache,
+        recursion_depth=recursion_depth,
+        max_paths=max_paths,
     )
 
 
@@ -43,6 +168,9 @@ def endpoint_include_fields(
     root,
     include,
     root_classname,
+    clone_cache=None,
+    recursion_depth=None,
+    max_paths=MAX_MODEL_PATHS,
 ):
     return clone_include(
         DummyRootPath(
@@ -51,12 +179,38 @@ def endpoint_include_fields(
         ),
         root_classname,
         include,
+        clone_cache=CloneCache() if clone_cache is None else clone_cache,
+        recursion_depth=recursion_depth,
+        max_paths=max_paths,
     )
 
 
-def handle_recursion(prefix):
-    # TODO try to find recursion pattern === identical adjacent sequences of path ids
-    raise RuntimeError("recursion somewhere")
+class RecursiveReferenceError(RuntimeError):
+    """Raised when entity references form a cycle and no recursion depth is given"""
+
+    def __init__(self, cycle: list[str]):
+        self.cycle = cycle
+        super().__init__(
+            f"entity references form a cycle: {' -> '.join(cycle)} (specify a recursion depth to cut off recursive references)"
+        )
+
+    def __reduce__(self):
+        # keep the cycle when passed between processes
+        return (self.__class__, (self.cycle,))
+
+
+class ModelSizeError(RuntimeError):
+    """Raised when an endpoint model grows larger than the maximum number of paths"""
+
+    def __init__(self, path_id: str, max_paths: int):
+        self.path_id = path_id
+        self.max_paths = max_paths
+        super().__init__(
+            f"the endpoint model of '{path_id}' has more than {max_paths} fields (select fewer fields, or specify a lower recursion depth to cut off recursive references earlier)"
+        )
+
+    def __reduce__(self):
+        return (self.__class__, (self.path_id, self.max_paths))
 
 
 def debug(task, path, msg, depth):
@@ -71,6 +225,32 @@ def debug_filter(path, msg, depth=0):
     debug("filtering", path, msg, depth)
 
 
+def clone_path_array(parent: WissKIPath, path: WissKIPath) -> tuple[tuple, int]:
+    """Return the path_array of a clone of path below parent, with all prefixes that
+    already exist in the parent set to None and the datatype_property appended, and the
+    number of the parent's binding vars that the clone inherits"""
+    if len(path.path_array) > len(parent.path_array):
+        shared_prefix = 0
+        for i in range(len(parent.path_array)):
+            if (
+                parent.path_array[i] is None
+                or path.path_array[i] == parent.path_array[i]
+            ):
+                shared_prefix = i + 1
+            else:
+                break
+        path_array = (None,) * shared_prefix + path.path_array[shared_prefix:]
+        inherited_vars = len(parent.binding_vars)
+    else:
+        # child of an entity_reference
+        path_array = (None, *path.path_array[1:])
+        inherited_vars = 1
+
+    if path.datatype_property:
+        path_array = (*path_array, path.datatype_property)
+    return (path_array, inherited_vars)
+
+
 def create_clone(
     parent: WissKIPath,
     fieldname: str,
@@ -80,11 +260,10 @@ def create_clone(
     depth=0,
     resolve_entity_references=True,
 ) -> tuple[WissKIPath, dict[PathElement, list[str]]]:
-    # shallow copy
+    # shallow copy, the path_array tuple is shared until it is modified
     clone = copy.copy(parent.fields[fieldname])
-    clone.path_array = copy.copy(clone.path_array)
 
-    if parent.path_array == []:
+    if not parent.path_array:
         debug_clone(
             clone,
             f"root type, changing classname from {clone.class_name} to {fieldname}",
@@ -92,36 +271,17 @@ def create_clone(
         clone.class_name = fieldname
         clone.root = True
 
-    varnames = copy.copy(parent.binding_vars) if parent.binding_vars else [fieldname]
-
     if clone.entity_reference and resolve_entity_references:
         debug_clone(clone, f"entity reference to '{clone.entity_reference.id}'", depth)
         clone.fields = clone.entity_reference.fields
         clone.class_name = f"{parent.class_name}_{clone.entity_reference.class_name}"
         clone.id = clone.entity_reference.id
-    # set parent paths to None
-    if len(clone.path_array) > len(parent.path_array):
-        for i in range(len(parent.path_array)):
-            if (
-                parent.path_array[i] is None
-                or clone.path_array[i] == parent.path_array[i]
-            ):
-                debug_clone(
-                    clone,
-                    f"ignoring prefix because it exists in parent '{parent.id}'",
-                    depth,
-                )
-                clone.path_array[i] = None
-            else:
-                break
-    else:
-        # child of an entity_reference
-        varnames = [parent.binding_vars[-1]]
-        clone.path_array[0] = None
 
-    if clone.datatype_property:
-        debug_clone(clone, f"adding datatype_property to {clone.path_array}")
-        clone.path_array.append(clone.datatype_property)
+    # set parent paths to None
+    clone.path_array, inherited_vars = clone_path_array(parent, clone)
+    varnames = (
+        parent.binding_vars[-inherited_vars:] if parent.binding_vars else [fieldname]
+    )
 
     if parent.binding_vars:
         for name in create_names(
@@ -177,7 +337,62 @@ def clone_exclude(
     used_names=set(),
     depth=0,
     resolve_entity_references=True,
+    clone_cache: CloneCache | None = None,
+    recursion_depth: int | None = None,
+    max_paths: int | None = None,
+) -> WissKIPath:
+    return clone_tree(
+        "exclude",
+        parent,
+        fieldname,
+        exclude,
+        prefix,
+        used_names,
+        depth,
+        resolve_entity_references,
+        clone_cache,
+        recursion_depth,
+        max_paths,
+    )
+
+
+def clone_include(
+    parent: WissKIPath,
+    fieldname: str,
+    include,
+    prefix=[],
+    used_names=set(),
+    depth=0,
+    resolve_entity_references=True,
+    clone_cache: CloneCache | None = None,
+    recursion_depth: int | None = None,
+    max_paths: int | None = None,
 ) -> WissKIPath:
+    return clone_tree(
+        "include",
+        parent,
+        fieldname,
+        include,
+        prefix,
+        used_names,
+        depth,
+        resolve_entity_references,
+        clone_cache,
+        recursion_depth,
+        max_paths,
+    )
+
+
+def expand_exclude(
+    parent: WissKIPath,
+    fieldname: str,
+    exclude,
+    prefix,
+    used_names,
+    depth,
+    resolve_entity_references,
+) -> tuple[WissKIPath, list]:
+    """Clone a single path, returns the clone and the (fieldname, exclude, resolve_entity_references) of its children"""
     clone, excludes = create_clone(
         parent,
         fieldname,
@@ -197,41 +412,33 @@ def clone_exclude(
         clone.type = WISSKI_TYPES["uri"]
         clone.fields = {}
         # clone.datatype_property = None
-        return clone
+        return (clone, [])
 
     if "%" in exclude:
         resolve_entity_references = False
 
     excludes = {a.entity: b for a, b in excludes.items()}
 
-    try:
-        clone.fields = {
-            name: clone_exclude(
-                clone,
-                name,
-                excludes.get(f.id, []),
-                prefix,
-                used_names,
-                depth + 1,
-                resolve_entity_references,
-            )
+    return (
+        clone,
+        [
+            (name, excludes.get(f.id, []), resolve_entity_references)
             for name, f in clone.fields.items()
             if excludes.get(f.id, None) != []
-        }
-    except RecursionError:
-        handle_recursion(prefix)
-    return clone
+        ],
+    )
 
 
-def clone_include(
+def expand_include(
     parent: WissKIPath,
     fieldname: str,
     include,
-    prefix=[],
-    used_names=set(),
-    depth=0,
-    resolve_entity_references=True,
-) -> WissKIPath:
+    prefix,
+    used_names,
+    depth,
+    resolve_entity_references,
+) -> tuple[WissKIPath, list]:
+    """Clone a single path, returns the clone and the (fieldname, include, resolve_entity_references) of its children"""
     clone, includes = create_clone(
         parent, fieldname, include, prefix, used_names, depth, resolve_entity_references
     )
@@ -244,41 +451,208 @@ def clone_include(
             clone.count = include.count
             clone.cardinality = 1
             clone.type = "int"
+        return (clone, [])
     elif "**" in include or "%%" in include:
-        clone.fields = {
-            name: clone_include(
-                clone,
-                name,
-                ["**"],
-                prefix,
-                used_names,
-                depth + 1,
-                resolve_entity_references and "**" in include,
-            )
-            for name in clone.fields
-        }
+        return (
+            clone,
+            [
+                (name, ["**"], resolve_entity_references and "**" in include)
+                for name in clone.fields
+            ],
+        )
     else:
         # TODO handle inverted paths
         includes = {
             a.entity: a if a.count or a.distinct else b for a, b in includes.items()
         }
-        clone.fields = {
-            name: clone_include(
-                clone,
-                name,
-                includes.get(name, includes.get("*", [])),
-                prefix,
-                used_names,
-                depth + 1,
-                resolve_entity_references and "%" not in include,
-            )
-            for name in clone.fields
-            if "*" in include or "%" in include or name in includes
-            or any(i.startswith("*.") for i in include)
-        }
+        return (
+            clone,
+            [
+                (
+                    name,
+                    includes.get(name, includes.get("*", [])),
+                    resolve_entity_references and "%" not in include,
+                )
+                for name in clone.fields
+                if "*" in include
+                or "%" in include
+                or name in includes
+                or any(i.startswith("*.") for i in include)
+            ],
+        )
+
+
+def finish_include(clone: WissKIPath, depth):
     if len(clone.fields) == 0 and not clone.datatype_property and not clone.type:
         debug_filter(clone, "class is down to 0 fields", depth)
         clone.type = WISSKI_TYPES["uri"]
     else:
         debug_filter(clone, f"remaining fields {list(clone.fields.keys())}", depth)
-    return clone
+
+
+# expand and finish functions of the clone_tree() tasks, finish is optional
+CLONE_TASKS = {
+    "exclude": (expand_exclude, None),
+    "include": (expand_include, finish_include),
+}
+
+
+def count_paths(clone: WissKIPath) -> int:
+    """The number of paths of a cloned subtree, including its root"""
+    count = 0
+    stack = [clone]
+    while stack:
+        path = stack.pop()
+        count += 1
+        stack.extend(path.fields.values())
+    return count
+
+
+class CloneFrame:
+    """A path that is being cloned, but whose children are not all cloned yet"""
+
+    def __init__(self, parent, fieldname, clone, children, group, key, depth):
+        self.parent = parent
+        self.fieldname = fieldname
+        self.path_id = parent.fields[fieldname].id
+        self.clone = clone
+        self.children = iter(children)
+        self.fields = {}
+        # the root or entity reference target id if this clone is a group, else None
+        self.group = group
+        self.key = key
+        self.depth = depth
+        # entity reference targets resolved within this subtree
+        self.refs = {group} if group else set()
+        # whether a recursive reference was cut off within this subtree
+        self.cut = False
+
+
+def clone_tree(
+    task: str,
+    parent: WissKIPath,
+    fieldname: str,
+    filterspec,
+    prefix=[],
+    used_names=set(),
+    depth=0,
+    resolve_entity_references=True,
+    clone_cache: CloneCache | None = None,
+    recursion_depth: int | None = None,
+    max_paths: int | None = None,
+) -> WissKIPath:
+    """Clone the path parent.fields[fieldname] and all of its fields, filtered according
+    to the include or exclude filterspec.
+
+    Uses an explicit stack instead of recursion, so arbitrarily deep nesting is supported.
+    Entity references whose target is already being cloned further up the tree form a
+    cycle: if recursion_depth is None, a RecursiveReferenceError reporting the cycle is
+    raised, otherwise such references are followed recursion_depth times before they are
+    cut off and only returned as an URI. If the clone has more than max_paths paths, a
+    ModelSizeError is raised."""
+    expand, finish = CLONE_TASKS[task]
+    stack: list[CloneFrame] = []
+    # how often each group occurs in the chain of clones on the stack
+    groups = Counter()
+    # the number of paths cloned or reused so far
+    size = 0
+
+    def grow(paths: int):
+        nonlocal size
+        size += paths
+        if max_paths is not None and size > max_paths:
+            raise ModelSizeError(
+                (stack[0].path_id if stack else parent.fields[fieldname].id),
+                max_paths,
+            )
+
+    def visit(parent, fieldname, filterspec, resolve_entity_references, depth):
+        """Return a finished clone (or None) and the entity reference targets resolved
+        within it. If the clone has fields, a frame is pushed and None is returned instead"""
+        path = parent.fields[fieldname]
+        key = None
+        # the top level clone is named after the endpoint and therefore never cached
+        if clone_cache is not None and parent.binding_vars:
+            key = clone_cache.key(
+                task, parent, fieldname, filterspec, resolve_entity_references
+            )
+            if (cached := clone_cache.lookup(key, parent, groups)) is not None:
+                debug_clone(cached[0], "reusing cached subtree", depth)
+                if max_paths is not None:
+                    grow(count_paths(cached[0]))
+                return cached
+
+        group = None if parent.binding_vars else path.id
+        clone, children = expand(
+            parent,
+            fieldname,
+            filterspec,
+            prefix,
+            used_names,
+            depth,
+            resolve_entity_references,
+        )
+        grow(1)
+        frame = CloneFrame(parent, fieldname, clone, children, group, key, depth)
+        if resolve_entity_references and path.entity_reference:
+            frame.group = path.entity_reference.id
+            frame.refs = {frame.group}
+            # a reference back into an entity that is currently being expanded only
+            # recurses if any of its fields are actually selected
+            if groups[frame.group] and children:
+                if recursion_depth is None:
+                    first = next(
+                        i for i, f in enumerate(stack) if f.group == frame.group
+                    )
+                    raise RecursiveReferenceError(
+                        [
+                            frame.group,
+                            *(f.path_id for f in stack[first + 1 :]),
+                            path.id,
+                            frame.group,
+                        ]
+                    )
+                if groups[frame.group] > recursion_depth:
+                    debug_clone(
+                        clone,
+                        f"cutting off recursive reference to '{frame.group}'",
+                        depth,
+                    )
+                    clone.type = WISSKI_TYPES["uri"]
+                    clone.fields = {}
+                    frame.children = iter(())
+                    frame.group = None
+                    frame.refs = set()
+                    frame.cut = True
+        if frame.group:
+            groups[frame.group] += 1
+        stack.append(frame)
+        return None
+
+    visit(parent, fieldname, filterspec, resolve_entity_references, depth)
+    while True:
+        frame = stack[-1]
+        for name, child_filterspec, child_resolve in frame.children:
+            if (
+                child := visit(
+                    frame.clone, name, child_filterspec, child_resolve, frame.depth + 1
+                )
+            ) is None:
+                break
+            frame.fields[name], refs = child
+            frame.refs |= refs
+        else:
+            # all fields are cloned
+            stack.pop()
+            if frame.group:
+                groups[frame.group] -= 1
+            frame.clone.fields = frame.fields
+            if finish is not None:
+                finish(frame.clone, frame.depth)
+            if frame.key is not None and not frame.cut:
+                clone_cache.store(frame.key, frame.parent, frame.clone, frame.refs)
+            if not stack:
+                return frame.clone
+            stack[-1].fields[frame.fieldname] = frame.clone
+            stack[-1].refs |= frame.refs
+            stack[-1].cut |= frame.cut
@@ -0,0 +1,154 @@
+"""Generate the models and queries of endpoints, optionally using a pool of worker processes"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from wisskas import manifest
+from wisskas.filter import CloneCache, endpoint_exclude_fields, endpoint_include_fields
+from wisskas.serialize import (
+    serialize_model,
+    serialize_query,
+    serialize_values_query,
+)
+from wisskas.string_utils import path_to_camelcase, path_to_filename
+
+logger = logging.getLogger(__name__)
+
+
+# state of the current (worker) process, set up by init_generator()
+generator = {}
+
+
+def init_generator(paths, args):
+    """Share the nested paths and generation options with generate_endpoint()"""
+    generator["paths"] = paths
+    generator["args"] = args
+    # cloned subtrees are shared between all endpoints generated by this process
+    generator["clone_cache"] = CloneCache()
+
+
+def generate_endpoint(spec):
+    """Clone the endpoint model described by spec and render its model and query.
+
+    Returns the endpoint root, the model and query source code and the clone cache
+    hits and misses caused by this endpoint."""
+    endpoint_path, path_id, task, filters, key_field, extra = spec
+    args = generator["args"]
+    clone_cache = generator["clone_cache"]
+    hits, misses = clone_cache.hits, clone_cache.misses
+
+    endpoint_fields = (
+        endpoint_include_fields if task == "include" else endpoint_exclude_fields
+    )
+    root = endpoint_fields(
+        generator["paths"][path_id],
+        filters,
+        path_to_camelcase(endpoint_path),
+        clone_cache,
+        args.recursion_depth,
+        args.max_model_size,
+    )
+    root.key_field = key_field
+    root.orderable_fields = extra["orderable"]
+    root.filterable_fields = extra["filterable"]
+
+    # this is the local filename
+    root.filename = get_prefixed_filename(args, endpoint_path).rsplit("/", 1)[-1]
+    root.item_key = root.key_field
+    root.everything_optional = args.everything_optional
+
+    model = serialize_model(root)
+    strategy = args.endpoint_query_strategy.get(endpoint_path, args.query_strategy)
+    if strategy != "optional" and root.filterable_fields:
+        # the text filter applies to single result rows, which would drop the values
+        # of all fields bound in other UNION arms
+        if strategy == "union":
+            logger.warning(
+                f"using the optional query strategy for filterable endpoint {endpoint_path}"
+            )
+        strategy = "optional"
+    query = serialize_query(
+        root, args.prefix, strategy=strategy, optimized=args.optimize_queries
+    )
+    # listing endpoint totals and pages of root ids are queried separately, without the
+    # optional fields
+    if not root.item_key:
+        root.count_query = serialize_query(
+            root, args.prefix, "count", optimized=args.optimize_queries
+        )
+        root.ids_query = serialize_query(
+            root, args.prefix, "ids", optimized=args.optimize_queries
+        )
+        # the values of the filterable fields are queried by the search index job
+        if args.search_index and root.filterable_fields:
+            root.search_queries = [
+                serialize_values_query(
+                    root,
+                    field_binding(root, field, endpoint_path),
+                    args.prefix,
+                    optimized=args.optimize_queries,
+                )
+                for field in root.filterable_fields
+            ]
+    return (
+        root,
+        model,
+        query,
+        clone_cache.hits - hits,
+        clone_cache.misses - misses,
+    )
+
+
+def field_binding(root, name: str, endpoint_path: str) -> str:
+    """The binding of a field of an endpoint model, named like the fields of rdfproxy's
+    ModelSPARQLMap: fields of nested models are prefixed with their model's class name"""
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        for fieldname, field in path.fields.items():
+            if field.fields:
+                stack.append(field)
+            elif name == (
+                fieldname if path is root else f"{path.class_name}.{fieldname}"
+            ):
+                return field.binding
+    raise RuntimeError(
+        f"filterable field '{name}' of endpoint {endpoint_path} does not exist"
+    )
+
+
+def generate_endpoint_in_worker(spec):
+    """Run generate_endpoint() in a worker process, returning only the attributes of the
+    endpoint root so the cloned model and the pathbuilder graph are not pickled"""
+    root, *results = generate_endpoint(spec)
+    return (manifest.endpoint_attributes(root), *results)
+
+
+def generate_endpoints(specs, paths, args):
+    """Yield the results of generate_endpoint() for all specs, in order. The endpoint roots
+    generated by worker processes are stand-ins (see manifest.endpoint_stand_in())"""
+    jobs = min(args.jobs, len(specs))
+    if jobs <= 1:
+        init_generator(paths, args)
+        yield from map(generate_endpoint, specs)
+        return
+
+    logger.info(f"generating {len(specs)} endpoints using {jobs} processes")
+    if "fork" in multiprocessing.get_all_start_methods():
+        # forked workers inherit the paths instead of unpickling them from initargs
+        init_generator(paths, args)
+        executor = ProcessPoolExecutor(
+            jobs, mp_context=multiprocessing.get_context("fork")
+        )
+    else:
+        executor = ProcessPoolExecutor(
+            jobs, initializer=init_generator, initargs=(paths, args)
+        )
+    with executor:
+        for attributes, *results in executor.map(generate_endpoint_in_worker, specs):
+            yield (manifest.endpoint_stand_in(attributes), *results)
+
+
+def get_prefixed_filename(args, path):
+    return f"{args.output_prefix}_{path_to_filename(path)}"
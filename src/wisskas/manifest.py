@@ -0,0 +1,191 @@
+"""Manifest of the files written by `wisskas endpoints`, used for incremental regeneration.
+
+For every endpoint the manifest records a hash over everything its model and query are
+generated from: the pathbuilder paths reachable from the endpoint root, the endpoint
+specification, the namespace prefixes and generation options, and the version of the
+templates. Endpoints whose hash did not change since the last run are not regenerated.
+The manifest also records a hash of every written file, so files that were modified or
+deleted on disk are regenerated as well, and the default page size of the generated
+listing endpoints is recorded for `wisskas snapshot`."""
+
+import functools
+import hashlib
+import importlib.resources
+import json
+import logging
+import os
+import pathlib
+import tempfile
+
+from wisskas.cache import wisskas_version
+from wisskas.filter import DummyRootPath
+from wisskas.wisski import WissKIPath
+
+logger = logging.getLogger(__name__)
+
+# bump whenever the structure of the manifest changes
+MANIFEST_FORMAT = 5
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# endpoint root attributes needed to generate the entrypoint without the endpoint model
+ENDPOINT_ATTRIBUTES = (
+    "class_name",
+    "filename",
+    "key_field",
+    "item_key",
+    "orderable_fields",
+    "filterable_fields",
+    "count_query",
+    "ids_query",
+    "search_queries",
+)
+
+
+def manifest_filename(output_prefix: str) -> pathlib.Path:
+    return pathlib.Path(f"{output_prefix}{MANIFEST_SUFFIX}")
+
+
+def content_hash(content: str | bytes) -> str:
+    return hashlib.sha256(
+        content.encode() if isinstance(content, str) else content
+    ).hexdigest()
+
+
+def file_hash(filename) -> str | None:
+    """Return the content hash of a file, or None if it does not exist"""
+    try:
+        return content_hash(pathlib.Path(filename).read_bytes())
+    except FileNotFoundError:
+        return None
+
+
+@functools.cache
+def template_version() -> str:
+    """Hash the wisskas version together with the contents of all templates"""
+    digest = hashlib.sha256(wisskas_version().encode())
+    templates = importlib.resources.files("wisskas") / "templates"
+    for template in sorted(templates.iterdir(), key=lambda t: t.name):
+        if not template.is_file():
+            continue
+        digest.update(template.name.encode())
+        digest.update(template.read_bytes())
+    return digest.hexdigest()
+
+
+def path_signature(path: WissKIPath) -> tuple:
+    """The parsed pathbuilder definition of a single path"""
+    return (
+        path.id,
+        path.description,
+        path.cardinality,
+        tuple(str(p) for p in path.path_array),
+        str(path.datatype_property) if path.datatype_property else None,
+        path.group_id,
+        path.rdf_class,
+        path.class_name,
+        path.type,
+        path.entity_reference.id
+        if isinstance(path.entity_reference, WissKIPath)
+        else path.entity_reference,
+        tuple(path.fields),
+    )
+
+
+def subtree_hash(path: WissKIPath) -> str:
+    """Hash the definitions of all paths an endpoint on the given path can include, that
+    is all (nested) fields and the paths of all entities they (indirectly) refer to"""
+    digest = hashlib.sha256()
+    seen = set()
+    stack = [path]
+    while stack:
+        path = stack.pop()
+        if path.id in seen:
+            continue
+        seen.add(path.id)
+        digest.update(repr(path_signature(path)).encode())
+        if isinstance(path.entity_reference, WissKIPath):
+            stack.append(path.entity_reference)
+        stack.extend(reversed(path.fields.values()))
+    return digest.hexdigest()
+
+
+def endpoint_hash(path: WissKIPath, *options) -> str:
+    """Hash everything the model and query of an endpoint on the given path depend on"""
+    digest = hashlib.sha256(subtree_hash(path).encode())
+    digest.update(
+        json.dumps(
+            [MANIFEST_FORMAT, template_version(), *options], default=repr
+        ).encode()
+    )
+    return digest.hexdigest()
+
+
+def empty_manifest() -> dict:
+    return {"format": MANIFEST_FORMAT, "endpoints": {}, "files": {}, "page_size": None}
+
+
+def endpoint_attributes(root: WissKIPath) -> dict:
+    """The attributes of an endpoint root that the entrypoint is generated from, which
+    (unlike the endpoint model and the pathbuilder graph it refers to) are cheap to pass
+    between processes"""
+    return {name: getattr(root, name) for name in ENDPOINT_ATTRIBUTES}
+
+
+def endpoint_entry(root: WissKIPath, hash: str, filenames: list[str]) -> dict:
+    return {
+        "hash": hash,
+        "files": filenames,
+        "endpoint": endpoint_attributes(root),
+    }
+
+
+def endpoint_stand_in(attributes: dict) -> DummyRootPath:
+    """Return a stand-in for an endpoint root with the given endpoint_attributes()"""
+    root = DummyRootPath(attributes["class_name"])
+    for name, value in attributes.items():
+        setattr(root, name, value)
+    return root
+
+
+def entry_endpoint(entry: dict) -> DummyRootPath:
+    """Return a stand-in for the root of an endpoint that was not regenerated"""
+    return endpoint_stand_in(entry["endpoint"])
+
+
+def load(output_prefix: str) -> dict:
+    """Return the manifest of a previous run, or an empty manifest"""
+    filename = manifest_filename(output_prefix)
+    try:
+        with open(filename) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return empty_manifest()
+    except ValueError as e:
+        logger.warning(f"ignoring unreadable manifest '{filename}': {e}")
+        return empty_manifest()
+    if manifest.get("format") != MANIFEST_FORMAT:
+        logger.info(f"ignoring manifest '{filename}' written by a different version")
+        return empty_manifest()
+    return manifest
+
+
+def store(output_prefix: str, manifest: dict) -> None:
+    filename = manifest_filename(output_prefix)
+    logger.info(f"writing manifest '{filename}'")
+    # write atomically, so an interrupted run never leaves a truncated manifest
+    with tempfile.NamedTemporaryFile(
+        "w", dir=filename.parent, suffix=".tmp", delete=False
+    ) as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(f.name, filename)
+
+
+def unchanged(manifest: dict, filenames) -> bool:
+    """Whether all files still have the content recorded in the manifest"""
+    return all(
+        filename in manifest["files"]
+        and file_hash(filename) == manifest["files"][filename]
+        for filename in filenames
+    )
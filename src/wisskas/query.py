@@ -0,0 +1,422 @@
+"""Intermediate representation of endpoint queries, and a static optimizer over it.
+
+query_patterns() translates a cloned endpoint model (see wisskas.filter) into a Query:
+the bindings to select and a tree of Patterns for its WHERE clause, which mirrors the
+model's tree of paths. serialize_query() renders the Query after optionally passing it
+to optimize(), which rewrites it into an equivalent query that triple stores can
+evaluate with fewer intermediate results:
+
+- inverse predicates are written as plain triple patterns (`?a ^p ?b` is `?b p ?a`)
+- required patterns are moved ahead of all OPTIONALs of their group
+- triple patterns that are repeated within a group, or in an OPTIONAL of a group that
+  already requires them, are removed
+- sibling OPTIONALs of which one only contains a subset of the other's patterns are
+  merged into a single OPTIONAL, with the remaining patterns nested in another OPTIONAL
+
+Every rewrite is only carried out if it does not change the query results, which
+depends on which variables the rewritten patterns share (see the individual passes)."""
+
+import math
+from collections.abc import Iterator
+
+from wisskas.string_utils import PathElement
+from wisskas.wisski import WissKIPath
+
+# assumed number of values of a multi-valued field, to estimate query result sizes with
+EXPECTED_VALUES = 3
+
+
+class Pattern:
+    """A group of query patterns: triple patterns followed by nested patterns.
+
+    The kind determines how the group is written inside its parent:
+
+    - "group": inline, it is part of the parent's group graph pattern
+    - "optional": in an OPTIONAL
+    - "union": in an OPTIONAL of a UNION of its children (which are all inline groups)
+    - "count": in an OPTIONAL subquery that counts the bindings of variable per
+      group_by binding (which is BIND to variable in the parent)
+
+    Triples are (subject, predicate, object) tuples of variable names and PathElements,
+    type patterns have a predicate of None and the class as their object."""
+
+    __slots__ = ("children", "distinct", "group_by", "kind", "triples", "variable")
+
+    def __init__(
+        self,
+        kind: str,
+        triples: list[tuple] | None = None,
+        children: list["Pattern"] | None = None,
+        variable: str | None = None,
+        group_by: str | None = None,
+        distinct: bool = False,
+    ):
+        self.kind = kind
+        self.triples = triples or []
+        self.children = children or []
+        self.variable = variable
+        self.group_by = group_by
+        self.distinct = distinct
+
+    def __repr__(self):
+        return f"Pattern({self.kind!r}, {self.triples!r}, {self.children!r})"
+
+
+class Query:
+    """The projection of a query, as (nesting level, variable) pairs of the endpoint
+    model's bindings, and the pattern of its WHERE clause. With roots="count" or
+    roots="ids", the query selects the number or the ids of the distinct roots (the
+    first variable of the projection) instead, with roots="values" the distinct
+    combinations of the projected variables."""
+
+    __slots__ = ("projection", "roots", "where")
+
+    def __init__(self, projection: list[tuple[int, str]], where: Pattern, roots=None):
+        self.projection = projection
+        self.where = where
+        self.roots = roots
+
+
+def query_layout(path: WissKIPath, strategy: str) -> tuple[bool, int]:
+    """Return whether to query the multi-valued fields of path in UNION arms instead of
+    one OPTIONAL each, and the estimated number of result rows per match of path.
+
+    OPTIONALs return the cross product of the values of all fields, UNION arms the sum.
+    The "auto" strategy only uses UNION arms when the product is more than twice the
+    sum, since joining a few short lists is cheaper than the extra patterns."""
+    branches = multivalued_fields(path)
+    rows = [EXPECTED_VALUES * query_layout(branch, strategy)[1] for branch in branches]
+    union = len(branches) > 1 and (
+        strategy == "union" or (strategy == "auto" and math.prod(rows) > 2 * sum(rows))
+    )
+    return union, sum(rows) if union else math.prod(rows)
+
+
+def multivalued_fields(path: WissKIPath) -> list[WissKIPath]:
+    return [
+        field
+        for field in path.fields.values()
+        if field.cardinality == -1 and not field.count
+    ]
+
+
+def union_branches(path: WissKIPath, strategy: str) -> list[WissKIPath]:
+    """The fields of path to query in UNION arms (see query_layout())"""
+    return multivalued_fields(path) if query_layout(path, strategy)[0] else []
+
+
+def path_triples(path: WissKIPath) -> list[tuple]:
+    """The triple patterns of the path_array elements that a path does not share with
+    its parent"""
+    triples = []
+    for i, element in enumerate(path.path_array):
+        if element is None:
+            continue
+        if i % 2 == 0:
+            triples.append((path.binding_vars[i // 2], None, element))
+        else:
+            triples.append(
+                (
+                    path.binding_vars[i // 2],
+                    element,
+                    path.binding_vars[i // 2 + 1],
+                )
+            )
+    return triples
+
+
+def query_patterns(root: WissKIPath, roots=None, strategy="optional") -> Query:
+    """Translate an endpoint model into a Query. Fields with a cardinality of -1 (or all
+    fields if the endpoint root has everything_optional set) are OPTIONAL, queries for
+    the roots only leave out all optional fields. The strategy ("optional", "union" or
+    "auto") determines how multi-valued fields are queried, see query_layout()"""
+
+    def optional(path):
+        return root.everything_optional or path.cardinality == -1
+
+    def build(path: WissKIPath, kind: str) -> Pattern:
+        union = [] if roots else union_branches(path, strategy)
+        pattern = Pattern(kind, path_triples(path))
+        for child in path.fields.values():
+            if roots and (child.count or optional(child)):
+                # optional fields do not change which roots match
+                continue
+            if child.count:
+                count = build(child, "count")
+                count.variable = child.binding_vars[-1]
+                count.group_by = path.binding_vars[-1]
+                count.distinct = bool(child.distinct)
+                pattern.children.append(count)
+            elif child not in union:
+                pattern.children.append(
+                    build(child, "optional" if optional(child) else "group")
+                )
+        if union:
+            pattern.children.append(
+                Pattern("union", children=[build(child, "group") for child in union])
+            )
+        return pattern
+
+    projection = []
+    stack = [(1, root)]
+    while stack:
+        level, path = stack.pop()
+        projection.append((level, path.binding_vars[-1]))
+        stack.extend((level + 1, f) for f in reversed(path.fields.values()))
+    return Query(projection, build(root, "group"), roots)
+
+
+def triple_variables(triple: tuple) -> set[str]:
+    subject, predicate, object = triple
+    return {subject} if predicate is None else {subject, object}
+
+
+def members(pattern: Pattern) -> Iterator[Pattern]:
+    """The pattern and all inline groups nested in it, whose triple patterns form a
+    single basic graph pattern"""
+    stack = [pattern]
+    while stack:
+        member = stack.pop()
+        yield member
+        stack.extend(
+            reversed([child for child in member.children if child.kind == "group"])
+        )
+
+
+def nested(pattern: Pattern) -> Iterator[Pattern]:
+    """The patterns nested in pattern that are not inline groups (OPTIONALs, UNIONs and
+    count subqueries), in query order"""
+    for member in members(pattern):
+        yield from (child for child in member.children if child.kind != "group")
+
+
+def required_triples(pattern: Pattern) -> list[tuple]:
+    return [triple for member in members(pattern) for triple in member.triples]
+
+
+def variables(pattern: Pattern, skip: Pattern | None = None) -> set[str]:
+    """All variables used in pattern, including nested patterns except skip"""
+    found = set()
+    stack = [pattern]
+    while stack:
+        pattern = stack.pop()
+        if pattern is skip:
+            continue
+        for triple in pattern.triples:
+            found |= triple_variables(triple)
+        if pattern.kind == "count":
+            found |= {pattern.variable, f"{pattern.variable}_count", pattern.group_by}
+        stack.extend(pattern.children)
+    return found
+
+
+def scopes(pattern: Pattern) -> Iterator[Pattern]:
+    """The patterns that form a group graph pattern of their own (the WHERE clause,
+    OPTIONALs, UNION arms and subqueries), outer ones first"""
+    stack = [pattern]
+    while stack:
+        scope = stack.pop()
+        yield scope
+        for child in reversed(list(nested(scope))):
+            stack.extend(reversed(child.children) if child.kind == "union" else [child])
+
+
+def normalize(query: Query) -> Query:
+    """Write inverse predicates as plain triple patterns, so patterns that only differ
+    in their direction are recognized as duplicates"""
+    for scope in scopes(query.where):
+        for member in members(scope):
+            member.triples = [
+                (object, PathElement(predicate.entity), subject)
+                if predicate is not None and predicate.inverted
+                else (subject, predicate, object)
+                for subject, predicate, object in member.triples
+            ]
+    return query
+
+
+def deduplicate(query: Query) -> Query:
+    """Remove repeated triple patterns.
+
+    A triple pattern that occurs twice in the same basic graph pattern is redundant. A
+    triple pattern inside an OPTIONAL that its enclosing group already requires only
+    restricts the OPTIONAL's variables to the values they are joined with anyway, unless
+    its variables connect patterns of the OPTIONAL that would not be connected without
+    it. It is therefore only removed if each of its variables is either also used by
+    the OPTIONAL's remaining required patterns, or not used anywhere else in the
+    OPTIONAL. This is only done in groups whose required patterns all precede their
+    OPTIONALs (see hoist_required()), so they are bound when the OPTIONALs are joined.
+    Empty OPTIONALs are removed."""
+    stack = [(query.where, set())]
+    while stack:
+        scope, outer = stack.pop()
+        if not required_first(scope):
+            outer = set()
+        seen = set()
+        for member in members(scope):
+            kept = []
+            for triple in member.triples:
+                if triple not in seen:
+                    seen.add(triple)
+                    kept.append(triple)
+            member.triples = kept
+        for triple in list(seen & outer):
+            member = next(m for m in members(scope) if triple in m.triples)
+            member.triples.remove(triple)
+            rest = set().union(*map(triple_variables, required_triples(scope)))
+            used = variables(scope)
+            if not all(
+                variable in rest or variable not in used
+                for variable in triple_variables(triple)
+            ):
+                member.triples.append(triple)
+                continue
+            seen.remove(triple)
+        if not required_first(scope):
+            seen = set()
+        for member in members(scope):
+            member.children = [
+                child
+                for child in member.children
+                if child.kind == "group"
+                or child.triples
+                or child.children
+                or child.kind == "count"
+            ]
+            for child in member.children:
+                if child.kind == "optional":
+                    stack.append((child, seen))
+                elif child.kind == "union":
+                    stack.extend((arm, set()) for arm in child.children)
+                elif child.kind == "count":
+                    # subqueries are evaluated on their own
+                    stack.append((child, set()))
+    return query
+
+
+def flat(scope: Pattern) -> bool:
+    """Whether all nested patterns of a scope are direct children of it"""
+    return all(
+        child.kind == "group"
+        for member in members(scope)
+        if member is not scope
+        for child in member.children
+    )
+
+
+def required_first(scope: Pattern) -> bool:
+    """Whether all required patterns of a scope precede its nested patterns"""
+    kinds = [child.kind == "group" for child in scope.children]
+    return flat(scope) and kinds == sorted(kinds, reverse=True)
+
+
+def detachable(query: Query, member: Pattern, child: Pattern) -> bool:
+    """Whether the only variables a nested pattern shares with the rest of the query
+    are bound by the triple patterns of the group it is nested in"""
+    return variables(child) & variables(query.where, skip=child) <= set().union(
+        *map(triple_variables, member.triples)
+    )
+
+
+def hoist_required(query: Query) -> Query:
+    """Move the required patterns of every group ahead of its OPTIONALs, UNIONs and
+    count subqueries (which are moved from inline groups to the group itself).
+
+    A required pattern after an OPTIONAL is joined with the OPTIONAL's results instead
+    of restricting the solutions first. Moving the OPTIONAL does not change the results
+    if the only variables it shares with the rest of the query are bound by the triple
+    patterns of the group it is nested in, no patterns are moved in groups where that
+    is not the case."""
+    for scope in scopes(query.where):
+        if required_first(scope):
+            continue
+        if not all(
+            detachable(query, member, child)
+            for member in members(scope)
+            for child in member.children
+            if child.kind != "group"
+        ):
+            continue
+        nested_patterns = list(nested(scope))
+        for member in members(scope):
+            member.children = [c for c in member.children if c.kind == "group"]
+        scope.children.extend(nested_patterns)
+    return query
+
+
+def merge_optionals(query: Query) -> Query:
+    """Merge sibling OPTIONALs of which one (the prefix) requires a subset of the triple
+    patterns the other one requires: the other one's remaining patterns are nested in
+    the prefix, in an OPTIONAL of their own (unless there are none).
+
+    This does not change the results as long as the other OPTIONAL only shares the
+    variables of the prefix's required patterns with the rest of the query, and its
+    nested patterns only share those of them that its remaining patterns use. Only OPTIONALs whose nested patterns are direct children (see
+    hoist_required()) are merged."""
+    for scope in scopes(query.where):
+        merged = True
+        while merged:
+            merged = False
+            optionals = [
+                child
+                for child in scope.children
+                if child.kind == "optional" and flat(child)
+            ]
+            for a in optionals:
+                for b in optionals:
+                    if a is not b and merge(query, scope, a, b):
+                        merged = True
+                        break
+                if merged:
+                    break
+    return query
+
+
+def merge(query: Query, scope: Pattern, prefix: Pattern, other: Pattern) -> bool:
+    """Merge the OPTIONAL other into the OPTIONAL prefix if that does not change the
+    results (see merge_optionals()), return whether it was merged"""
+    required = required_triples(prefix)
+    if not required or not set(required) <= set(required_triples(other)):
+        return False
+    remaining = [t for t in required_triples(other) if t not in required]
+    required_variables = set().union(*map(triple_variables, required))
+    remaining_variables = set().union(*map(triple_variables, remaining))
+    other_nested = list(nested(other))
+    nested_variables = set().union(*map(variables, other_nested))
+    # the other OPTIONAL is only joined with the rest of the query on the variables of
+    # the prefix's required patterns...
+    if (variables(other) - required_variables) & variables(query.where, skip=other):
+        return False
+    # ...and its nested patterns are only joined with the remaining patterns
+    if remaining and (nested_variables & required_variables) - remaining_variables:
+        return False
+    scope.children.remove(other)
+    if remaining:
+        prefix.children.append(Pattern("optional", remaining, other_nested))
+    else:
+        prefix.children.extend(other_nested)
+    return True
+
+
+def prune(query: Query, keep: set[str]) -> Query:
+    """Remove the OPTIONALs, UNIONs and count subqueries that are detachable (see
+    detachable()) and do not bind any of the keep variables themselves: they cannot
+    change which combinations of the keep variables the query returns, only how often"""
+    for scope in scopes(query.where):
+        for member in members(scope):
+            bound = set().union(*map(triple_variables, member.triples))
+            member.children = [
+                child
+                for child in member.children
+                if child.kind == "group"
+                or (variables(child) - bound) & keep
+                or not detachable(query, member, child)
+            ]
+    return query
+
+
+def optimize(query: Query) -> Query:
+    """Rewrite query into an equivalent query (see the module docstring)"""
+    for rewrite in (normalize, hoist_required, deduplicate, merge_optionals):
+        query = rewrite(query)
+    return query
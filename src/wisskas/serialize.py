@@ -1,10 +1,55 @@
-from jinja2 import Environment, PackageLoader, select_autoescape
+import logging
+
+from jinja2 import BytecodeCache, Environment, PackageLoader, select_autoescape
+from jinja2.bccache import Bucket
+
+from wisskas import cache
+from wisskas.query import Query, optimize, prune, query_patterns
+from wisskas.string_utils import PathElement
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateBytecodeCache(BytecodeCache):
+    """Persists compiled templates in the wisskas cache directory (see wisskas.cache), so
+    templates are only compiled once instead of on every process start"""
+
+    @staticmethod
+    def key(bucket: Bucket) -> str:
+        # the bucket validates the template source checksum and the python/jinja version
+        return cache.cache_key(bucket.key, "template")
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        if (code := cache.load(self.key(bucket))) is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        cache.store(self.key(bucket), bucket.bytecode_to_string())
+
+
+env = Environment(
+    loader=PackageLoader("wisskas"),
+    autoescape=select_autoescape(),
+    bytecode_cache=TemplateBytecodeCache(),
+)
+
+
+def apply_prefixes(path: PathElement, prefixes: dict[str, str]) -> str:
+    """Abbreviate the URI of a path element with a namespace prefix, if any applies"""
+    prefixed = "".join(
+        path.entity.replace(uri, f"{prefix}:")
+        for prefix, uri in prefixes.items()
+        if path.entity.startswith(uri)
+    )
+    return ("^" if path.inverted else "") + (prefixed or f"<{path.entity}>")
 
-env = Environment(loader=PackageLoader("wisskas"), autoescape=select_autoescape())
 
 # add support for any/all filters
 env.filters["any"] = any
 env.filters["all"] = all
+env.filters["apply_prefixes"] = apply_prefixes
+# python literals
+env.filters["repr"] = repr
 
 
 def serialize(template_name, **kwargs):
@@ -21,6 +66,16 @@ def serialize_entrypoint(
     page_size=None,
     httpx_args={},
     logging=False,
+    queries=None,
+    pool={},
+    async_handlers=False,
+    counts_ttl=None,
+    cache={},
+    coalesce=True,
+    root_ids=False,
+    keyset=False,
+    batch_size=0,
+    search=None,
 ) -> str:
     return serialize(
         "entrypoint.py",
@@ -33,6 +88,27 @@ def serialize_entrypoint(
             "page_size": page_size,
             "httpx_args": httpx_args,
             "logging": logging,
+            "queries": queries,
+            "pool": pool,
+            "async_handlers": async_handlers,
+            "counts_ttl": counts_ttl,
+            "cache": cache,
+            "coalesce": coalesce,
+            "root_ids": root_ids,
+            "keyset": keyset,
+            "batch_size": batch_size,
+            "search": search,
+        },
+    )
+
+
+def serialize_search_index(endpoints, backend_address, httpx_args={}) -> str:
+    return serialize(
+        "search_index.py",
+        **{
+            "endpoints": endpoints,
+            "backend_address": backend_address,
+            "httpx_args": httpx_args,
         },
     )
 
@@ -41,5 +117,28 @@ def serialize_model(root):
     return serialize("model.py", **{"root": root})
 
 
-def serialize_query(root, prefixes={}):
-    return serialize("query.rq", **{"root": root, "prefixes": prefixes})
+def serialize_query(
+    root, prefixes={}, roots=None, strategy="optional", optimized=False
+):
+    """Render the query of an endpoint. With roots="count" or roots="ids", render a query
+    for the number or the ids of the distinct endpoint roots instead, which leaves out
+    all optional patterns. The strategy ("optional", "union" or "auto") determines how
+    multi-valued fields are queried, see wisskas.query.query_layout(). With optimized,
+    the query is rewritten by wisskas.query.optimize() first"""
+    query = query_patterns(root, roots, strategy)
+    return render_query(optimize(query) if optimized else query, prefixes)
+
+
+def serialize_values_query(root, binding, prefixes={}, optimized=False):
+    """Render a query for the distinct values of one binding of an endpoint together
+    with their roots, which leaves out all patterns that do not bind it"""
+    query = query_patterns(root)
+    variable = query.projection[0][1]
+    query = prune(
+        Query([(1, variable), (1, binding)], query.where, "values"), {variable, binding}
+    )
+    return render_query(optimize(query) if optimized else query, prefixes)
+
+
+def render_query(query: Query, prefixes={}):
+    return serialize("query.rq", **{"query": query, "prefixes": prefixes})
@@ -0,0 +1,234 @@
+"""Static snapshots of all endpoints written by `wisskas endpoints`, to be served as
+plain files (e.g. from a CDN) instead of running the FastAPI app.
+
+The query parameters of the app's URLs become paths in the snapshot directory: the
+response of `<url>?page=<page>` (at the page size the endpoints were generated with,
+unless another one is given) is written to `<url>/page/<page>.json`, with the items
+ordered by their id, and the response of `<url>?id=<key>` to `<url>/<key>.json`, with
+the key percent-encoded. The items of item endpoints are queried in pages of keys,
+bound in a VALUES block like by the app's batch endpoints. An `index.json` at the top of
+the directory lists the endpoints with their totals and pages, and the content hash of
+every file. Files whose content did not change since the last snapshot are not
+rewritten, and files of pages or items that no longer exist are removed."""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import pathlib
+import re
+import tempfile
+import urllib.parse
+
+import httpx
+from rdflib import Literal
+from rdfproxy import Page
+from rdfproxy.mapper import _ModelBindingsMapper
+from rdfproxy.utils.sparql_utils import replace_query_select_clause
+from rdfproxy.utils.utils import FieldsBindingsMap
+
+from wisskas import manifest
+from wisskas.export import Exporter, insert_values, load_model
+from wisskas.manifest import content_hash, file_hash
+
+logger = logging.getLogger(__name__)
+
+# bump whenever the structure of the index changes
+SNAPSHOT_FORMAT = 1
+
+INDEX_FILENAME = "index.json"
+
+# the page size of the generated app, for endpoints generated before it was recorded
+DEFAULT_PAGE_SIZE = 10
+
+
+def page_filename(url: str, page: int) -> str:
+    return f"{url.strip('/')}/page/{page}.json"
+
+
+def item_filename(url: str, key: str) -> str:
+    return f"{url.strip('/')}/{urllib.parse.quote(key, safe='')}.json"
+
+
+def insert_keys(query: str, binding: str, keys: list[str]) -> str:
+    """Bind the given keys to the string value of binding at the start of the query
+    pattern, like the batch endpoints of the generated app"""
+    values = " ".join(Literal(key).n3() for key in keys)
+    where = re.search(r"\bwhere\s*{", query, flags=re.IGNORECASE).end()
+    return (
+        f"{query[:where]} VALUES ?_key {{ {values} }} "
+        f"FILTER (STR(?{binding}) = ?_key) {query[where:]}"
+    )
+
+
+def load_index(directory: pathlib.Path) -> dict:
+    """Return the index of a previous snapshot, or an empty index"""
+    try:
+        with open(directory / INDEX_FILENAME) as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+    if index.get("format") != SNAPSHOT_FORMAT:
+        return {"format": SNAPSHOT_FORMAT, "endpoints": {}, "files": {}}
+    return index
+
+
+def write_file(filename: pathlib.Path, content: str) -> None:
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    # write atomically, so the files being served are never incomplete
+    with tempfile.NamedTemporaryFile(
+        "w", dir=filename.parent, suffix=".tmp", delete=False
+    ) as f:
+        f.write(content)
+    os.replace(f.name, filename)
+
+
+class Snapshot:
+    """Writes the files of a snapshot, skipping the ones whose content is unchanged"""
+
+    def __init__(self, directory: str, jobs: int):
+        self.directory = pathlib.Path(directory)
+        self.previous = load_index(self.directory)
+        self.index = {"format": SNAPSHOT_FORMAT, "endpoints": {}, "files": {}}
+        self.jobs = asyncio.Semaphore(jobs)
+        self.written = 0
+
+    async def write(self, filename: str, content: str) -> None:
+        digest = content_hash(content)
+        self.index["files"][filename] = digest
+        # file I/O blocks, so it is done in a worker thread
+        if await asyncio.to_thread(file_hash, self.directory / filename) != digest:
+            await asyncio.to_thread(write_file, self.directory / filename, content)
+            self.written += 1
+
+    async def listing(self, url: str, exporter: Exporter, count_query: str) -> None:
+        async with self.jobs:
+            total = await exporter.count(count_query)
+        pages = math.ceil(total / exporter.page_size)
+
+        async def write_page(page: int):
+            async with self.jobs:
+                items = await exporter.models(page)
+            await self.write(
+                page_filename(url, page + 1),
+                Page[exporter.model](
+                    items=items,
+                    page=page + 1,
+                    size=exporter.page_size,
+                    total=total,
+                    pages=pages,
+                ).model_dump_json(),
+            )
+
+        # like the listing endpoint, the first page exists even if there are no items
+        await asyncio.gather(*(write_page(page) for page in range(max(pages, 1))))
+        self.index["endpoints"][url] = {
+            "total": total,
+            "pages": pages,
+            "size": exporter.page_size,
+        }
+        logger.info(f"{url}: {total} items in {pages} pages")
+
+    async def items(self, url: str, exporter: Exporter, key_field: str) -> None:
+        binding = FieldsBindingsMap(exporter.model)[key_field]
+        keys_query = replace_query_select_clause(
+            exporter.query, f"SELECT DISTINCT ?{binding}"
+        )
+        async with self.jobs:
+            total = await exporter.count(
+                replace_query_select_clause(
+                    exporter.query, f"SELECT (COUNT(DISTINCT ?{binding}) AS ?cnt)"
+                )
+            )
+        size = exporter.page_size
+        written = 0
+
+        async def write_page(page: int):
+            nonlocal written
+            async with self.jobs:
+                keys = [
+                    str(row[binding])
+                    for row in await exporter.bindings(
+                        f"{keys_query} ORDER BY STR(?{binding}) "
+                        f"LIMIT {size} OFFSET {page * size}"
+                    )
+                ]
+                if not keys:
+                    return
+                # root IRIs are bound directly, so the store can look up the items first
+                bindings = await exporter.bindings(
+                    insert_values(exporter.query, binding, keys)
+                    if binding == exporter.root
+                    else insert_keys(exporter.query, binding, keys)
+                )
+            rows = {}
+            for row in bindings:
+                rows.setdefault(str(row[binding]), []).append(row)
+            for key in keys:
+                models = _ModelBindingsMapper(
+                    exporter.model, rows.get(key, [])
+                ).get_models()
+                if len(models) != 1:
+                    logger.warning(f"{url}: skipping key {key} of {len(models)} items")
+                    continue
+                await self.write(item_filename(url, key), models[0].model_dump_json())
+                written += 1
+
+        await asyncio.gather(
+            *(write_page(page) for page in range(math.ceil(total / size)))
+        )
+        self.index["endpoints"][url] = {"items": written}
+        logger.info(f"{url}: {written} items")
+
+    def store(self) -> int:
+        """Write the index and remove the files that are no longer part of the snapshot,
+        return the number of removed files"""
+        removed = self.previous["files"].keys() - self.index["files"].keys()
+        for filename in removed:
+            (self.directory / filename).unlink(missing_ok=True)
+        write_file(
+            self.directory / INDEX_FILENAME,
+            json.dumps(self.index, indent=2, sort_keys=True) + "\n",
+        )
+        return len(removed)
+
+
+async def snapshot(
+    output_prefix: str,
+    target: str,
+    directory: str,
+    page_size: int | None = None,
+    jobs: int = 4,
+    httpx_args: dict | None = None,
+) -> tuple[int, int, int]:
+    """Write a snapshot of all endpoints generated with the given output prefix to
+    directory, with pages of page_size items (default: the page size the endpoints were
+    generated with). Return the numbers of files in the snapshot, (re)written files and
+    removed files"""
+    generated = manifest.load(output_prefix)
+    endpoints = generated["endpoints"]
+    page_size = page_size or generated["page_size"] or DEFAULT_PAGE_SIZE
+    if not endpoints:
+        raise RuntimeError(
+            f"no endpoints in the manifest of '{output_prefix}', generate them with `wisskas endpoints -o {output_prefix}` first"
+        )
+    result = Snapshot(directory, jobs)
+    async with httpx.AsyncClient(**(httpx_args or {})) as client:
+        tasks = []
+        for url, entry in sorted(endpoints.items()):
+            endpoint = entry["endpoint"]
+            exporter = Exporter(
+                client,
+                target,
+                *load_model(output_prefix, endpoint),
+                endpoint["ids_query"],
+                page_size,
+            )
+            if endpoint["item_key"]:
+                tasks.append(result.items(url, exporter, endpoint["item_key"]))
+            else:
+                tasks.append(result.listing(url, exporter, endpoint["count_query"]))
+        await asyncio.gather(*tasks)
+    removed = result.store()
+    return len(result.index["files"]), result.written, removed
@@ -1,3 +1,5 @@
+import weakref
+
 FILTER_PATH_SEPARATOR = "."
 FILTER_PATH_INVERSION = "^"
 
@@ -9,25 +11,48 @@ class PathElement:
     - count marked by a trailing '#'
     - distinct marked by a trailing '!'
 
-    Can be used for any string, not just RDF predicates."""
+    Can be used for any string, not just RDF predicates.
+
+    Instances are interned (constructing a PathElement from the same string twice returns
+    the same object while it is in use) and must therefore be treated as immutable."""
+
+    __slots__ = ("__weakref__", "_hash", "count", "distinct", "entity", "inverted")
 
-    def __init__(self, entity: str = ""):
+    # instances are dropped once no parsed paths refer to them anymore
+    _interned: weakref.WeakValueDictionary[str, "PathElement"] = (
+        weakref.WeakValueDictionary()
+    )
+
+    def __new__(cls, entity: str = ""):
+        try:
+            return cls._interned[entity]
+        except KeyError:
+            pass
+        self = super().__new__(cls)
         self.inverted = entity.startswith("^")
-        self.entity = entity[1 if self.inverted else 0 :]
-        self.distinct = self.entity.endswith("!")
-        self.entity = self.entity[: -1 if self.distinct else None]
-        self.count = self.entity.endswith("#")
-        self.entity = self.entity[: -1 if self.count else None]
+        stripped = entity[1 if self.inverted else 0 :]
+        self.distinct = stripped.endswith("!")
+        stripped = stripped[: -1 if self.distinct else None]
+        self.count = stripped.endswith("#")
+        self.entity = stripped[: -1 if self.count else None]
+        self._hash = hash(str(self))
+        cls._interned[entity] = self
+        return self
 
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, self.__class__)
             and self.entity == other.entity
             and self.inverted == other.inverted
         )
 
     def __hash__(self):
-        return self.__str__().__hash__()
+        return self._hash
+
+    def __reduce__(self):
+        # re-intern on unpickling/copying
+        suffix = ("#" if self.count else "") + ("!" if self.distinct else "")
+        return (self.__class__, (str(self) + suffix,))
 
     def __repr__(self):
         return f"PathElement('{str(self)}')"
@@ -0,0 +1,240 @@
+"""Synthetic pathbuilder definitions of arbitrary size, for performance testing.
+
+Every root type is a tree of groups: each group has `fields` data or entity reference
+fields, and the groups above the given `depth` have `fan_out` nested groups each, so a
+root type has `1 + fan_out + ... + fan_out ** depth` groups with `1 + fields` paths
+each. A share of `references` of the fields refer to another root type, and a share of
+`multivalued` of the fields and nested groups have cardinality -1. Without `cycles`,
+fields only refer to root types defined after their own, so the references form a DAG;
+with cycles they can refer to any root type, including their own.
+
+The output only depends on the parameters and the seed.
+
+    python -m wisskas.synthetic --root-types 100 --depth 3 > pathbuilder.xml
+"""
+
+import argparse
+import random
+import sys
+import uuid
+
+from lxml import etree
+
+NAMESPACE = "https://example.org/synthetic/"
+
+# a few of the data fields use the other WissKI field types with a python equivalent
+FIELD_TYPES = ["string"] * 7 + ["uri", "datetime", "list_string"]
+
+# the elements of a <path> definition, in the order WissKI exports them
+PATH_ELEMENTS = (
+    "id",
+    "weight",
+    "enabled",
+    "group_id",
+    "bundle",
+    "field",
+    "fieldtype",
+    "displaywidget",
+    "formatterwidget",
+    "cardinality",
+    "field_type_informative",
+    "path_array",
+    "datatype_property",
+    "short_name",
+    "disamb",
+    "description",
+    "uuid",
+    "is_group",
+    "name",
+)
+
+
+class PathbuilderGenerator:
+    """Builds the <path> elements of a synthetic pathbuilder definition"""
+
+    def __init__(
+        self,
+        root_types: int,
+        depth: int,
+        fan_out: int,
+        fields: int,
+        references: float,
+        multivalued: float,
+        cycles: bool,
+        seed: int,
+    ):
+        self.root_types = root_types
+        self.depth = depth
+        self.fan_out = fan_out
+        self.fields = fields
+        self.references = references
+        self.multivalued = multivalued
+        self.cycles = cycles
+        self.random = random.Random(seed)
+        self.root = etree.Element("pathbuilderinterface")
+        self.properties = 0
+
+    def hex_id(self) -> str:
+        return f"{self.random.getrandbits(128):032x}"
+
+    def property(self) -> str:
+        self.properties += 1
+        return f"{NAMESPACE}P{self.properties}"
+
+    def cardinality(self) -> int:
+        return -1 if self.random.random() < self.multivalued else 1
+
+    def add_path(self, id, group_id, name, path_array, is_group, **values):
+        values = {
+            "id": id,
+            "weight": len(self.root),
+            "enabled": 1,
+            "group_id": group_id or 0,
+            "bundle": self.hex_id(),
+            "field": self.hex_id() if group_id else None,
+            "datatype_property": "empty",
+            "disamb": 0,
+            "uuid": uuid.UUID(int=self.random.getrandbits(128), version=4),
+            "is_group": int(is_group),
+            "name": name,
+            **values,
+        }
+        path = etree.SubElement(self.root, "path")
+        for tag in PATH_ELEMENTS:
+            element = etree.SubElement(path, tag)
+            if tag == "path_array":
+                # alternating classes and properties
+                for i, step in enumerate(path_array):
+                    etree.SubElement(element, "y" if i % 2 else "x").text = step
+            elif values.get(tag) is not None:
+                element.text = str(values[tag])
+
+    def add_field(self, id, group_id, type_index, path_array):
+        if self.random.random() < self.references:
+            # without cycles, only root types after the field's own can be referred to
+            first = 0 if self.cycles else type_index + 1
+            if first < self.root_types:
+                target = self.random.randrange(first, self.root_types)
+                self.add_path(
+                    id,
+                    group_id,
+                    id,
+                    [*path_array, self.property(), f"{NAMESPACE}C{target}"],
+                    False,
+                    fieldtype="entity_reference",
+                    displaywidget="entity_reference_autocomplete",
+                    formatterwidget="entity_reference_rss_category",
+                    cardinality=self.cardinality(),
+                    field_type_informative="entity_reference",
+                )
+                return
+        fieldtype = self.random.choice(FIELD_TYPES)
+        self.add_path(
+            id,
+            group_id,
+            id,
+            path_array,
+            False,
+            fieldtype=fieldtype,
+            cardinality=self.cardinality(),
+            field_type_informative=fieldtype,
+            datatype_property=self.property(),
+        )
+
+    def add_group(self, id, group_id, type_index, path_array, level):
+        self.add_path(
+            id,
+            group_id,
+            id.replace("_", " ").capitalize(),
+            path_array,
+            True,
+            # root types are multi-valued, like in WissKI exports
+            cardinality=self.cardinality() if group_id else -1,
+        )
+        for i in range(self.fields):
+            self.add_field(f"{id}_f{i}", id, type_index, path_array)
+        if level < self.depth:
+            for i in range(self.fan_out):
+                self.add_group(
+                    f"{id}_g{i}",
+                    id,
+                    type_index,
+                    [*path_array, self.property(), f"{NAMESPACE}{id}_g{i}"],
+                    level + 1,
+                )
+
+    def generate(self) -> etree._Element:
+        for i in range(self.root_types):
+            self.add_group(f"t{i}", None, i, [f"{NAMESPACE}C{i}"], 0)
+        etree.indent(self.root, space="\t")
+        return self.root
+
+
+def generate_pathbuilder(
+    root_types: int = 10,
+    depth: int = 2,
+    fan_out: int = 2,
+    fields: int = 4,
+    references: float = 0.2,
+    multivalued: float = 0.3,
+    cycles: bool = True,
+    seed: int = 0,
+) -> bytes:
+    """Return a synthetic pathbuilder XML definition with the given shape (see the module
+    docstring), which is the same for the same parameters and seed"""
+    if min(root_types, depth, fan_out, fields) < 0:
+        raise ValueError(
+            "the numbers of root types, groups and fields must not be negative"
+        )
+    root = PathbuilderGenerator(
+        root_types, depth, fan_out, fields, references, multivalued, cycles, seed
+    ).generate()
+    return etree.tostring(root, encoding="utf-8", xml_declaration=False) + b"\n"
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--root-types", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=2, help="levels of nested groups")
+    parser.add_argument(
+        "--fan-out", type=int, default=2, help="nested groups per group"
+    )
+    parser.add_argument("--fields", type=int, default=4, help="fields per group")
+    parser.add_argument(
+        "--references",
+        type=float,
+        default=0.2,
+        help="share of the fields that are entity references",
+    )
+    parser.add_argument(
+        "--multivalued",
+        type=float,
+        default=0.3,
+        help="share of the fields and nested groups with cardinality -1",
+    )
+    parser.add_argument(
+        "--no-cycles",
+        dest="cycles",
+        action="store_false",
+        help="only refer to root types defined later, so there are no reference cycles",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+    sys.stdout.buffer.write(
+        generate_pathbuilder(
+            args.root_types,
+            args.depth,
+            args.fan_out,
+            args.fields,
+            args.references,
+            args.multivalued,
+            args.cycles,
+            args.seed,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
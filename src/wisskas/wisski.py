@@ -1,9 +1,11 @@
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
+import io
 import logging
 import pathlib
 
-from lxml import etree, objectify
+from lxml import etree
 
+from wisskas import cache as path_cache
 from wisskas.string_utils import PathElement, to_classname
 
 logger = logging.getLogger(__name__)
@@ -19,51 +21,120 @@ WISSKI_TYPES = {
 
 
 class WissKIPath:
-    def __init__(self, path_element: etree._Element):
+    # parsed from the pathbuilder definition: xml, id, description, cardinality,
+    #   path_array, datatype_property, group_id, rdf_class, class_name,
+    #   entity_reference, type
+    # set by nest_paths(): fields, parents
+    # set when cloning paths into endpoint models (see wisskas.filter): binding_vars,
+    #   binding, root, count, distinct
+    # endpoint-level settings, only set on endpoint root models: orderable_fields,
+    #   filterable_fields, key_field, item_key, filename, everything_optional,
+    #   count_query, ids_query, search_queries
+    __slots__ = (
+        "binding",
+        "binding_vars",
+        "cardinality",
+        "class_name",
+        "count",
+        "count_query",
+        "datatype_property",
+        "description",
+        "distinct",
+        "entity_reference",
+        "everything_optional",
+        "fields",
+        "filename",
+        "filterable_fields",
+        "group_id",
+        "id",
+        "ids_query",
+        "item_key",
+        "key_field",
+        "orderable_fields",
+        "parents",
+        "path_array",
+        "rdf_class",
+        "root",
+        "search_queries",
+        "type",
+        "xml",
+    )
+
+    def __init__(self, path_element: etree._Element, keep_xml=False):
         if path_element.tag != "path":
             # TODO @lupl needs to create a schema for WissKI paths and validate against it
             raise ValueError("WissKIPath expects a <path> element")
 
-        # raw data from WissKI XML
-        self.xml = path_element
+        # raw data from WissKI XML, only retained on request
+        self.xml = path_element if keep_xml else None
 
-        # computed/derived fields
-        self.cardinality = self.xml["cardinality"]
-        self.path_array = [
-            PathElement(el.text) for el in path_element.path_array.iterchildren()
-        ]
+        # computed/derived fields (plain python values, so paths don't hold on to the DOM)
+        self.cardinality = int(path_element.findtext("cardinality"))
+        # immutable, so it can be shared between a path and its clones
+        self.path_array = tuple(
+            PathElement(el.text) for el in path_element.find("path_array")
+        )
 
-        self.id = self.xml["id"].text
-        self.description = self.xml["name"].text
+        self.id = path_element.findtext("id")
+        self.description = path_element.findtext("name") or None
         self.fields = {}
         self.parents = {}
         self.binding_vars = []
 
         # TODO add to path instead?
+        datatype_property = path_element.findtext("datatype_property")
         self.datatype_property = (
-            PathElement(self.xml["datatype_property"].text)
-            if self.xml["datatype_property"] != "empty"
-            else None
+            PathElement(datatype_property) if datatype_property != "empty" else None
         )
 
         # set rdf class if this is a root type (== it has no parent group)
-        self.rdf_class = self.last_entity() if self.xml["group_id"] == 0 else None
-        self.group_id = self.xml["group_id"] if self.xml["group_id"] != 0 else None
+        group_id = path_element.findtext("group_id")
+        self.rdf_class = self.last_entity() if group_id == "0" else None
+        self.group_id = group_id if group_id != "0" else None
 
         # is_group is misleading, paths are groups if their fields isn't empty
         self.class_name = (
-            to_classname(self.description or self.id) if self.xml["is_group"] else None
+            to_classname(self.description or self.id)
+            if int(path_element.findtext("is_group") or 0)
+            else None
         )
 
-        self.entity_reference = self.xml["fieldtype"] == "entity_reference"
+        fieldtype = path_element.findtext("fieldtype")
+        self.entity_reference = fieldtype == "entity_reference"
 
         # set python field type
         self.type = (
-            WISSKI_TYPES[self.xml["fieldtype"]]
-            if self.xml["fieldtype"] and not self.entity_reference
-            else None
+            WISSKI_TYPES[fieldtype] if fieldtype and not self.entity_reference else None
         )
 
+        # all slots are always initialized, so copying never has to check for them
+        self.binding = self.root = self.count = self.distinct = None
+        self.orderable_fields = self.filterable_fields = None
+        self.key_field = self.item_key = self.filename = None
+        self.everything_optional = self.count_query = self.ids_query = None
+        self.search_queries = None
+
+    def __copy__(self):
+        clone = self.__class__.__new__(self.__class__)
+        for name in WissKIPath.__slots__:
+            setattr(clone, name, getattr(self, name))
+        if hasattr(self, "__dict__"):
+            clone.__dict__.update(self.__dict__)
+        return clone
+
+    def __getstate__(self):
+        # lxml elements are pickled as serialized XML
+        state = {name: getattr(self, name) for name in WissKIPath.__slots__}
+        if self.xml is not None:
+            state["xml"] = etree.tostring(self.xml)
+        return state
+
+    def __setstate__(self, state):
+        if state["xml"] is not None:
+            state["xml"] = etree.fromstring(state["xml"])
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def last_entity(self) -> str:
         return self.path_array[-1].entity
 
@@ -77,21 +148,53 @@ def root_type_dict(paths: Iterable[WissKIPath]) -> WissKIPaths:
 
 
 def parse_pathbuilder_paths(
-    xml: pathlib.Path | str, include_disabled=False
+    xml: pathlib.Path | str | bytes, include_disabled=False, cache=True, keep_xml=False
 ) -> WissKIPaths:
-    """Parses a pathbuilder XML definition from a file or XML string. Returns as a flat dict of WissKIPaths"""
-    if isinstance(xml, pathlib.Path):
-        root_element = objectify.parse(xml).getroot()
+    """Parses a pathbuilder XML definition from a file or XML string. Returns as a flat dict of WissKIPaths.
+
+    The raw XML <path> elements are only retained (as WissKIPath.xml) if keep_xml is True.
+    If cache is True, the parsed paths are looked up in/written to the on-disk cache (see wisskas.cache)
+    """
+    if not cache:
+        return check_paths(read_pathbuilder_paths(xml, include_disabled, keep_xml))
+
+    key = path_cache.cache_key(xml, include_disabled, keep_xml)
+    paths = path_cache.load(key)
+    if paths is None:
+        paths = read_pathbuilder_paths(xml, include_disabled, keep_xml)
+        path_cache.store(key, paths)
     else:
-        root_element = objectify.fromstring(xml)
-
-    return check_paths(
-        {
-            path_element["id"].text: WissKIPath(path_element)
-            for path_element in root_element.iterchildren()
-            if include_disabled or path_element.enabled
-        }
-    )
+        logger.debug(f"using cached pathbuilder definition for '{xml}'")
+    return check_paths(paths)
+
+
+def read_pathbuilder_paths(
+    xml: pathlib.Path | str | bytes, include_disabled=False, keep_xml=False
+) -> WissKIPaths:
+    """Parses a pathbuilder XML definition without consistency checks or caching"""
+    return {path.id: path for path in iterparse_paths(xml, include_disabled, keep_xml)}
+
+
+def iterparse_paths(
+    xml: pathlib.Path | str | bytes, include_disabled=False, keep_xml=False
+) -> Iterator[WissKIPath]:
+    """Incrementally parses a pathbuilder XML definition, yielding one WissKIPath per <path>.
+
+    Unless keep_xml is True, every <path> element is discarded right after it was
+    converted, so memory use does not grow with the size of the XML tree."""
+    if isinstance(xml, str):
+        xml = xml.encode()
+    if isinstance(xml, bytes):
+        xml = io.BytesIO(xml)
+
+    for _event, path_element in etree.iterparse(xml, events=("end",), tag="path"):
+        if include_disabled or int(path_element.findtext("enabled") or 0):
+            yield WissKIPath(path_element, keep_xml)
+        if not keep_xml:
+            path_element.clear(keep_tail=True)
+            # drop references to the already processed (now empty) siblings
+            while path_element.getprevious() is not None:
+                del path_element.getparent()[0]
 
 
 def check_paths(paths: WissKIPaths) -> WissKIPaths:
@@ -135,6 +238,7 @@ def nest_paths(
     return (root_types, paths)
 
 
-def parse_paths(xml: pathlib.Path | str) -> tuple[WissKIPaths, WissKIPaths]:
+def parse_paths(xml: pathlib.Path | str, cache=True) -> tuple[WissKIPaths, WissKIPaths]:
     """Return a tuple dicts, the first mapping RDF class names to WissKIPath, the second mapping WissKI path ids to WissKIPaths"""
-    return nest_paths(parse_pathbuilder_paths(xml))
+    # the nested graph is rebuilt from the (cached) flat paths, nesting is linear in the number of paths
+    return nest_paths(parse_pathbuilder_paths(xml, cache=cache))
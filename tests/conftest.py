@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path, monkeypatch):
+    """Keep the on-disk pathbuilder cache out of the user's home directory"""
+    monkeypatch.setenv("WISSKAS_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
@@ -0,0 +1,98 @@
+import os
+import pathlib
+
+from jinja2 import Environment, PackageLoader
+
+from wisskas import cache, wisski
+from wisskas.serialize import TemplateBytecodeCache, env
+from wisskas.wisski import parse_pathbuilder_paths, parse_paths
+
+test_data_file = pathlib.Path("tests/data/releven_assertions_20240821.xml")
+
+
+def test_cached_paths_are_equivalent(isolated_cache_dir):
+    uncached = parse_pathbuilder_paths(test_data_file, cache=False, keep_xml=True)
+    assert not isolated_cache_dir.exists()
+    parse_pathbuilder_paths(test_data_file, keep_xml=True)
+    assert len(list(isolated_cache_dir.glob("*.pickle"))) == 1
+    cached = parse_pathbuilder_paths(test_data_file, keep_xml=True)
+
+    assert cached.keys() == uncached.keys()
+    for path_id, path in uncached.items():
+        assert cached[path_id].path_array == path.path_array
+        assert cached[path_id].cardinality == path.cardinality
+        assert cached[path_id].xml.findtext("id") == path_id
+
+
+def test_cache_hit_skips_parsing(monkeypatch):
+    parse_paths(test_data_file)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("pathbuilder was parsed despite a cache hit")
+
+    monkeypatch.setattr(wisski, "read_pathbuilder_paths", fail)
+    root_types, paths = parse_paths(test_data_file)
+    assert paths["person"].rdf_class in root_types
+    assert len(paths["person"].fields) > 0
+
+
+def test_cache_key_depends_on_content_and_options():
+    content = test_data_file.read_bytes()
+    assert cache.cache_key(test_data_file, False) == cache.cache_key(content, False)
+    assert cache.cache_key(content, False) != cache.cache_key(content, True)
+    assert cache.cache_key(content, False) != cache.cache_key(content + b" ", False)
+
+
+def test_eviction(isolated_cache_dir, monkeypatch):
+    monkeypatch.setenv("WISSKAS_CACHE_SIZE", "1000")
+    cache.store("old", b"x" * 600)
+    os.utime(isolated_cache_dir / "old.pickle", (0, 0))
+    cache.store("new", b"x" * 600)
+    assert cache.load("old") is None
+    assert cache.load("new") == b"x" * 600
+
+
+def test_corrupt_entry_is_discarded(isolated_cache_dir):
+    isolated_cache_dir.mkdir()
+    (isolated_cache_dir / "broken.pickle").write_bytes(b"not a pickle")
+    assert cache.load("broken") is None
+    assert not (isolated_cache_dir / "broken.pickle").exists()
+
+
+def test_template_bytecode_cache(isolated_cache_dir, monkeypatch):
+    def environment():
+        environment = Environment(
+            loader=PackageLoader("wisskas"),
+            bytecode_cache=TemplateBytecodeCache(),
+        )
+        environment.filters.update(env.filters)
+        return environment
+
+    compiled = environment().get_template("entrypoint.py.jinja")
+    assert len(list(isolated_cache_dir.glob("*.pickle"))) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("template was compiled despite a cache hit")
+
+    cached_env = environment()
+    monkeypatch.setattr(cached_env, "compile", fail)
+    cached = cached_env.get_template("entrypoint.py.jinja")
+    assert cached.render(endpoints={}, pool={}, cache={}) == compiled.render(
+        endpoints={}, pool={}, cache={}
+    )
+
+
+def test_unpicklable_entry_is_not_stored(isolated_cache_dir):
+    cache.store("unpicklable", lambda: None)
+    assert cache.load("unpicklable") is None
+    assert list(isolated_cache_dir.iterdir()) == []
+
+
+def test_entry_evicted_while_loading(isolated_cache_dir, monkeypatch):
+    cache.store("evicted", b"x")
+
+    def evicted(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.load("evicted") == b"x"
@@ -1,3 +1,24 @@
+import ast
+import asyncio
+import functools
+import importlib
+import json
+import logging
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import httpx
+import pytest
+import rdflib
+from fastapi.testclient import TestClient
+from rdflib.plugins.sparql import prepareQuery
+
+import wisskas.export
+import wisskas.snapshot
 from wisskas.cli.main import main
 
 
@@ -16,9 +37,874 @@ def test_cli_endpoints():
     )
 
 
+def import_times(code: str) -> dict[str, int]:
+    """Run python code in a fresh interpreter and return the cumulative import time (in
+    microseconds) of every imported module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _self, cumulative, module = line.removeprefix("import time:").split("|")
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_import_time():
+    """subcommand dependencies are only imported when the subcommand is run"""
+    heavy = {"jinja2", "lxml", "pygments", "rich", "rich_argparse"}
+    times = import_times("import wisskas.cli.main")
+    assert not heavy & times.keys()
+
+    times = import_times(
+        f"from wisskas.cli.main import main; main({[*input_args, '--no-cache', 'paths', '-f', 'person']})"
+    )
+    assert {"lxml", "rich"} <= times.keys()
+    assert not {"jinja2", "wisskas.serialize", "wisskas.filter"} & times.keys()
+
+
 def test_cli_paths():
     """crash tests"""
     run_cli("paths", "--flat")
     run_cli("paths", "--flat", "--all")
+    run_cli("paths", "--flat", "person")
     run_cli("paths", "--nested")
     run_cli("paths", "--nested", "--all")
+    run_cli("--no-cache", "paths", "--nested")
+
+
+def test_cli_filter():
+    """crash tests"""
+    run_cli("filter", "id=person", "group_id=person")
+    run_cli("filter", "enabled=0", "--validate")
+
+
+def test_cli_endpoints_parallel(tmp_path):
+    """parallel generation writes the same files as a serial run"""
+    endpoints = [
+        *("-li", "person", "*", "person_appellation_assertion.*"),
+        *("-li", "publication/pubs", "%%"),
+        *("-ii", "external_authority/ea", "id", "*"),
+        *("-le", "gender/genders", "gender_label"),
+        *("-ie", "religion/r", "id"),
+    ]
+    outputs = {}
+    for jobs in ["1", "3"]:
+        (tmp_path / jobs).mkdir()
+        run_cli(
+            "endpoints",
+            *endpoints,
+            *("--jobs", jobs, "-o", f"{tmp_path / jobs}/api"),
+            *("-a", "http://example.org/sparql"),
+        )
+        outputs[jobs] = {
+            f.name: f.read_bytes() for f in sorted((tmp_path / jobs).glob("*.[pr][yq]"))
+        }
+    assert len(outputs["1"]) == 11
+    assert outputs["1"] == outputs["3"]
+
+
+def test_cli_endpoints_incremental(tmp_path, caplog):
+    """only endpoints whose specification changed are regenerated"""
+    caplog.set_level(logging.INFO)
+    output = [*("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql")]
+    run_cli("endpoints", "-li", "person", "*", "-le", "gender", *output)
+    first = {f.name: f.stat().st_mtime_ns for f in tmp_path.iterdir()}
+    assert "api.manifest.json" in first
+
+    caplog.clear()
+    run_cli("endpoints", "-li", "person", "*", "-le", "gender", "gender_label", *output)
+    second = {f.name: f.stat().st_mtime_ns for f in tmp_path.iterdir()}
+    assert "skipping 1 unchanged endpoints: /person" in caplog.text
+    assert second["api_person.py"] == first["api_person.py"]
+    assert second["api_gender.rq"] != first["api_gender.rq"]
+    assert second["api.py"] == first["api.py"]
+
+    # modified output files are regenerated, but only with --force
+    (tmp_path / "api_person.rq").write_text("")
+    with pytest.raises(SystemExit):
+        run_cli("endpoints", "-li", "person", "%", "-le", "gender", *output)
+    assert (tmp_path / "api_person.rq").read_text() == ""
+    caplog.clear()
+    run_cli(
+        "endpoints",
+        "-f",
+        "-li",
+        "person",
+        "*",
+        "-le",
+        "gender",
+        "gender_label",
+        *output,
+    )
+    assert (tmp_path / "api_person.rq").read_text() != ""
+    assert "skipping 1 unchanged endpoints: /gender" in caplog.text
+
+
+def sparql_transport(graph: rdflib.Graph) -> httpx.MockTransport:
+    """An HTTP transport that answers SPARQL queries from a local graph"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        query = urllib.parse.parse_qs(request.content.decode())["query"][0]
+        return httpx.Response(200, content=graph.query(query).serialize(format="json"))
+
+    return httpx.MockTransport(handler)
+
+
+PROSOPOGRAPHY = rdflib.Namespace("https://r11.eu/ns/prosopography/")
+CRM = rdflib.Namespace("http://www.cidoc-crm.org/cidoc-crm/")
+
+
+def religions_graph() -> rdflib.Graph:
+    """Two genders and three labelled religions, for the gender/genders and religion/r
+    endpoints"""
+    graph = rdflib.Graph()
+    for i in range(2):
+        graph.add(
+            (rdflib.URIRef(f"http://ex/g{i}"), rdflib.RDF.type, PROSOPOGRAPHY.C11)
+        )
+    for i in range(3):
+        religion = rdflib.URIRef(f"http://ex/r{i}")
+        graph.add((religion, rdflib.RDF.type, PROSOPOGRAPHY.C24))
+        graph.add((religion, CRM.P1_is_identified_by, rdflib.Literal(f"religion {i}")))
+    return graph
+
+
+@pytest.fixture
+def import_generated(tmp_path, monkeypatch):
+    """Import a module generated to tmp_path by its name"""
+    modules = set(sys.modules)
+    monkeypatch.syspath_prepend(tmp_path)
+    yield importlib.import_module
+    # the generated modules of all tests have the same names
+    for name in set(sys.modules) - modules:
+        if getattr(sys.modules[name], "__file__", "").startswith(str(tmp_path)):
+            del sys.modules[name]
+
+
+@pytest.fixture
+def serve(import_generated, monkeypatch):
+    """Import the app generated to tmp_path/<name>.py and return a client for it, with
+    the triple store queries answered from the given graph"""
+
+    def serve(graph: rdflib.Graph, name: str = "api") -> TestClient:
+        transport = sparql_transport(graph)
+        # rdfproxy's SPARQLModelAdapter queries using an AsyncClient of its own
+        monkeypatch.setattr(
+            httpx,
+            "AsyncClient",
+            functools.partial(httpx.AsyncClient, transport=transport),
+        )
+        api = import_generated(name)
+        api.TRIPLE_STORE.pool = transport
+        return TestClient(api.app)
+
+    return serve
+
+
+def test_cli_endpoints_app(tmp_path, serve):
+    """the generated app answers listing and item requests"""
+    run_cli(
+        "endpoints",
+        *("-le", "gender/genders", "gender_label", "-ie", "religion/r", "id"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "    adapter = SPARQLModelAdapter(" in entrypoint
+    with serve(religions_graph()) as client:
+        page = client.get("/genders", params={"size": 1, "page": 2}).json()
+        assert page["total"] == 2 and page["pages"] == 2
+        assert page["items"] == [{"id": "http://ex/g1"}]
+        item = client.get("/r", params={"id": "http://ex/r1"}).json()
+        assert item == {"id": "http://ex/r1", "religion_label": "religion 1"}
+        assert client.get("/r", params={"id": "http://ex/none"}).status_code == 404
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        ["--async", "--counts-endpoint", "--max-batch-size", "5"],
+        ["--root-id-pagination", "--search-index"],
+        ["--keyset-pagination", "--cache-ttl", "60", "--no-coalesce"],
+    ],
+    ids=["async", "root-ids", "keyset"],
+)
+def test_cli_endpoints_rdfproxy_internals(tmp_path, serve, options):
+    """the generated apps subclass and call private parts of rdfproxy, which are only
+    known to work with the rdfproxy versions that pyproject.toml allows"""
+    run_cli(
+        "endpoints",
+        *("-li", "religion/rs|religion_label", "religion_label"),
+        *("-ie", "religion/r", "id", "-o", f"{tmp_path}/api"),
+        *("-a", "http://example.org/sparql", *options),
+    )
+    with serve(religions_graph()) as client:
+        page = client.get("/rs", params={"size": 2}).json()
+        assert len(page["items"]) == 2
+        page = client.get("/rs", params={"query": "2"}).json()
+        assert [item["id"] for item in page["items"]] == ["http://ex/r2"]
+        item = client.get("/r", params={"id": "http://ex/r1"}).json()
+        assert item["religion_label"] == "religion 1"
+
+
+def test_cli_endpoints_inline_queries(tmp_path, serve):
+    """queries are embedded in the entrypoint, which does no file I/O"""
+    run_cli(
+        "endpoints",
+        *("-li", "person?person_descriptive_name|person_descriptive_name", "*"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        "--inline-queries",
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "open(" not in entrypoint
+    query = (tmp_path / "api_person.rq").read_text().replace("\n ", " ")
+    assert f'"api_person": {query!r},' in entrypoint
+    assert '"api_person": (\n        QUERIES["api_person"][:-2],' in entrypoint
+    with serve(rdflib.Graph()) as client:
+        assert client.get("/person", params={"query": "x"}).json()["total"] == 0
+
+
+def test_cli_endpoints_connection_pool(tmp_path, serve):
+    run_cli(
+        "endpoints",
+        *("-ie", "religion/r", "id"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        *("--timeout", "5", "--max-connections", "7", "--http2"),
+        *("--max-batch-size", "10"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "max_connections=7," in entrypoint
+    assert "max_keepalive_connections=20," in entrypoint
+    assert "http2=True," in entrypoint
+    assert (
+        'httpx_aclient_params={"transport": TRIPLE_STORE, "timeout": 5.0},'
+        in entrypoint
+    )
+    # only the batch endpoint, rdfproxy's SPARQLModelAdapter does not use the pool
+    assert entrypoint.count("httpx_aclient_params={") == 1
+    with serve(religions_graph()) as client:
+        assert client.get("/r", params={"id": "http://ex/r0"}).status_code == 200
+        items = client.post("/r/batch", json=["http://ex/r0", "http://ex/none"])
+        assert list(items.json()) == ["http://ex/r0"]
+
+
+def test_cli_endpoints_counts(tmp_path, serve):
+    """totals are counted using the root and required patterns of listing queries"""
+    run_cli(
+        "endpoints",
+        *("-li", "person", "*", "-ie", "religion/r", "id"),
+        *("-le", "gender/genders", "gender_label"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        *("--counts-endpoint", "--counts-ttl", "60"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    (count_query,) = re.findall(r'^    "/person": (.*),$', entrypoint, re.MULTILINE)
+    count_query = ast.literal_eval(count_query)
+    assert "SELECT (COUNT(DISTINCT ?Person) AS ?cnt)" in count_query
+    assert "?Person a <http://www.cidoc-crm.org/cidoc-crm/E21_Person> ." in count_query
+    assert "OPTIONAL" not in count_query
+    assert "OPTIONAL" in (tmp_path / "api_person.rq").read_text()
+    assert '    "/r": ' not in entrypoint
+    assert 'time.monotonic() - COUNTS["time"] >= 60.0:' in entrypoint
+    with serve(religions_graph()) as client:
+        assert client.get("/counts").json() == {"/genders": 2, "/person": 0}
+
+
+def test_cli_endpoints_root_id_pagination(tmp_path, serve):
+    run_cli(
+        "endpoints",
+        *("-li", "person", "*", "-ie", "religion/r", "id"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        "--root-id-pagination",
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    (ids_query,) = re.findall(
+        r'^    "api_person": (".*"|\'.*\'),$', entrypoint, re.MULTILINE
+    )
+    ids_query = ast.literal_eval(ids_query)
+    assert "SELECT DISTINCT ?Person\n" in ids_query
+    assert "OPTIONAL" not in ids_query
+    assert 'ids_query=IDS_QUERIES["api_person"],' in entrypoint
+    # only listing endpoints select pages by root id
+    assert '"api_r": ' not in entrypoint.split("IDS_QUERIES = {")[1].split("}")[0]
+    assert "    adapter = SPARQLModelAdapter(" in entrypoint
+    assert "    adapter = AsyncSPARQLModelAdapter(" in entrypoint
+    with serve(religions_graph()) as client:
+        assert client.get("/person").json()["total"] == 0
+        assert client.get("/r", params={"id": "http://ex/r2"}).status_code == 200
+
+
+def test_cli_endpoints_query_strategy(tmp_path):
+    run_cli(
+        "endpoints",
+        *("-li", "person", "*", "-li", "boulloterion/b", "*"),
+        *("-li", "publication/pubs", "%%", "-ii", "publication/pub", "id", "%%"),
+        *("-o", f"{tmp_path}/api", "--query-strategy", "auto"),
+        *("--endpoint-query-strategy", "/pubs", "union"),
+    )
+    # many multi-valued fields are queried in the arms of one UNION
+    person = (tmp_path / "api_person.rq").read_text()
+    assert person.count("} UNION {") == 10
+    assert "OPTIONAL {\n    {\n      ?Person_" in person
+    prepareQuery(person)
+    # ...but not only two
+    assert "UNION" not in (tmp_path / "api_b.rq").read_text()
+    assert "} UNION {" in (tmp_path / "api_pubs.rq").read_text()
+    assert "UNION" not in (tmp_path / "api_pub.rq").read_text()
+    # the other query patterns are the same, in a different order
+    run_cli(
+        "endpoints",
+        *("-li", "publication/pubs", "%%", "-o", f"{tmp_path}/opt"),
+    )
+    patterns = {
+        line.strip()
+        for line in (tmp_path / "opt_pubs.rq").read_text().splitlines()
+        if line.strip().endswith(" .")
+    }
+    assert patterns == {
+        line.strip()
+        for line in (tmp_path / "api_pubs.rq").read_text().splitlines()
+        if line.strip().endswith(" .")
+    }
+
+    # a text filter on one field would drop the rows of the other UNION arms
+    run_cli(
+        "endpoints",
+        *("-li", "publication/pubs|publication_reference", "%%"),
+        *("-o", f"{tmp_path}/filter", "--query-strategy", "union"),
+    )
+    assert "UNION" not in (tmp_path / "filter_pubs.rq").read_text()
+
+
+def test_cli_endpoints_keyset_pagination(tmp_path, serve, import_generated):
+    run_cli(
+        "endpoints",
+        *("-li", "person", "person_id_assignment", "person_descriptive_name"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        "--keyset-pagination",
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "params: Annotated[KeysetParameters, Query()]) -> CursorPage[Person]:" in (
+        entrypoint
+    )
+    assert "SINGLE_FLIGHT.run(key, adapter.get_keyset_page, params, [])" in entrypoint
+
+    # page through a graph with the generated query constructor
+    api = import_generated("api")
+    crm = rdflib.Namespace("http://www.cidoc-crm.org/cidoc-crm/")
+    graph = rdflib.Graph()
+    for i in range(10):
+        person = rdflib.URIRef(f"http://example.org/person{i}")
+        graph.add((person, rdflib.RDF.type, crm.E21_Person))
+        # several names per person, people are sorted by the first one
+        graph.add((person, crm.P3_has_note, rdflib.Literal(f"name {i % 3}")))
+        graph.add((person, crm.P3_has_note, rdflib.Literal(f"name {i % 4}")))
+    query = (tmp_path / "api_person.rq").read_text()
+    keys = []
+    last_key = None
+    while True:
+        query_constructor = api.KeysetQueryConstructor(
+            query, None, ["Person_person_descriptive_name"], 3, last_key
+        )
+        page = []
+        for row in graph.query(query_constructor.get_items_query()):
+            binding = {name: value.toPython() for name, value in row.asdict().items()}
+            key = query_constructor.get_key(binding)
+            if key not in page:
+                page.append(key)
+        keys += page
+        if len(page) < 3:
+            break
+        last_key = page[-1]
+    assert "FILTER" in query_constructor.get_items_query()
+    assert "offset" not in query_constructor.get_items_query().lower()
+    assert len(keys) == len({person for _, person in keys}) == 10
+    assert keys == sorted(keys)
+    assert keys[0] == ["name 0", "http://example.org/person0"]
+
+    with serve(graph) as client:
+        page = client.get("/person", params={"size": 8}).json()
+        assert len(page["items"]) == 8
+        cursor = page["next_cursor"]
+        page = client.get("/person", params={"size": 8, "cursor": cursor}).json()
+        assert len(page["items"]) == 2 and page["next_cursor"] is None
+
+
+def test_cli_endpoints_batch(tmp_path, serve, import_generated):
+    run_cli(
+        "endpoints",
+        *(
+            "-li",
+            "person",
+            "*",
+            "-ie",
+            "religion/r",
+            "id",
+            "-ie",
+            "gender/g",
+            "id",
+            "gender_label",
+        ),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        *("--max-batch-size", "50"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    # a batch variant of item endpoints only
+    assert entrypoint.count('@app.post("/') == 2
+    assert '@app.post("/r/batch")' in entrypoint
+    assert "Body(min_length=1, max_length=50)" in entrypoint
+    assert 'SINGLE_FLIGHT.run(key, adapter.get_items, "id", ids)' in entrypoint
+
+    # ids are bound in a VALUES block, items are grouped by id
+    api = import_generated("api")
+    query = (tmp_path / "api_g.rq").read_text()
+    constructor = api.BatchQueryConstructor(
+        query, api.G, "id", ["http://ex/g1", "http://ex/g0", "http://ex/g1"]
+    )
+    graph = rdflib.Graph()
+    for i in range(3):
+        graph.add(
+            (
+                rdflib.URIRef(f"http://ex/g{i}"),
+                rdflib.RDF.type,
+                rdflib.URIRef("https://r11.eu/ns/prosopography/C11"),
+            )
+        )
+    items_query = constructor.get_items_query()
+    assert "VALUES ?G { <http://ex/g1> <http://ex/g0> }" in items_query
+    bindings = [
+        {str(k): v.toPython() for k, v in row.asdict().items()}
+        for row in graph.query(items_query)
+    ]
+    items = constructor.get_items(bindings)
+    assert list(items) == ["http://ex/g1", "http://ex/g0"]
+    assert str(items["http://ex/g0"].id) == "http://ex/g0"
+
+    with serve(religions_graph()) as client:
+        items = client.post("/g/batch", json=["http://ex/g1", "http://ex/r1"]).json()
+        assert items == {"http://ex/g1": {"id": "http://ex/g1"}}
+        assert client.post("/r/batch", json=["x"] * 51).status_code == 422
+
+    run_cli(
+        "endpoints",
+        *("-ie", "religion/r", "id", "-o", f"{tmp_path}/nobatch", "-a", "http://x"),
+    )
+    assert "/batch" not in (tmp_path / "nobatch.py").read_text()
+
+
+def test_cli_endpoints_search_index(tmp_path, serve, import_generated, monkeypatch):
+    run_cli(
+        "endpoints",
+        *("-li", "publication/pubs|publication_reference", "%%"),
+        *("-li", "person", "*", "-ii", "publication/pub", "id", "%%"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        "--search-index",
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "import api_search_index" in entrypoint
+    assert entrypoint.count('api_search_index.search("api_pubs", params.query)') == 1
+    # without an index, the text is still filtered for
+    assert "text_filter(bindings, params.query)" in entrypoint
+
+    # only the patterns binding the filterable field are queried for the index
+    index = import_generated("api_search_index")
+    (query,) = index.VALUES_QUERIES["api_pubs"]
+    assert "OPTIONAL" not in query
+    assert index.search("api_pubs", "anything") is None
+
+    graph = rdflib.Graph()
+    for i, reference in enumerate(
+        ["Anna Komnene", "John Komnenos", 'anna "Dalassene"']
+    ):
+        publication = rdflib.URIRef(f"http://ex/p{i}")
+        graph.add(
+            (
+                publication,
+                rdflib.RDF.type,
+                rdflib.URIRef("https://r11.eu/ns/spec/Publication"),
+            )
+        )
+        graph.add(
+            (
+                publication,
+                rdflib.URIRef("http://www.cidoc-crm.org/cidoc-crm/P3_has_note"),
+                rdflib.Literal(reference),
+            )
+        )
+
+    def values(client, query):
+        for root, value in graph.query(query):
+            yield str(root), str(value)
+
+    monkeypatch.setattr(index, "values", values)
+    index.build()
+    search = index.search
+    assert search("api_pubs", "ANNA") == ["http://ex/p0", "http://ex/p2"]
+    assert search("api_pubs", 'dalassene" anna') == ["http://ex/p2", "http://ex/p0"]
+    assert search("api_pubs", "komnenos") == ["http://ex/p1"]
+    # words match the start of words
+    assert search("api_pubs", "komn") == ["http://ex/p0", "http://ex/p1"]
+    assert search("api_pubs", "nna") == []
+    assert search("api_pubs", " ") == []
+
+    # while there is no index, the app filters the query results for the words
+    run_cli(
+        "endpoints",
+        *("-li", "religion/rs|religion_label", "religion_label"),
+        *("-o", f"{tmp_path}/search", "-a", "http://example.org/sparql"),
+        *("--search-index", "--async"),
+    )
+    graph = religions_graph()
+    with serve(graph, "search") as client:
+
+        def search_results(text):
+            page = client.get("/rs", params={"query": text, "size": 2}).json()
+            return page["total"], [item["id"] for item in page["items"]]
+
+        assert search_results("ligion")[0] == 3
+        assert search_results("2 x") == (1, ["http://ex/r2"])
+        assert search_results("RELIG") == (0, [])
+        assert search_results('"') == (0, [])
+
+        # a failed build leaves no partial index behind
+        index = import_generated("search_search_index")
+
+        def unreachable(client, query):
+            raise httpx.ConnectError("triple store unreachable")
+            yield
+
+        monkeypatch.setattr(index, "values", unreachable)
+        with pytest.raises(httpx.ConnectError):
+            index.build()
+        assert list(tmp_path.glob("*.tmp")) == []
+        assert not index.INDEX_FILE.exists()
+
+        # values() answers from the current graph
+        monkeypatch.setattr(index, "values", values)
+        index.build()
+        assert search_results("RELIG 2") == (3, ["http://ex/r2", "http://ex/r0"])
+        assert search_results("ligion") == (0, [])
+        # the total only counts the results that are still items of the endpoint
+        graph.remove((rdflib.URIRef("http://ex/r0"), None, None))
+        assert search_results("RELIG 2") == (2, ["http://ex/r2", "http://ex/r1"])
+
+
+def test_cli_export(tmp_path, capsysbinary, monkeypatch):
+    run_cli(
+        "endpoints",
+        *("-li", "publication/pubs", "publication_reference"),
+        *("-o", f"{tmp_path}/api"),
+    )
+    graph = rdflib.Graph()
+    for i in range(7):
+        publication = rdflib.URIRef(f"http://ex/p{i}")
+        graph.add(
+            (
+                publication,
+                rdflib.RDF.type,
+                rdflib.URIRef("https://r11.eu/ns/spec/Publication"),
+            )
+        )
+        graph.add(
+            (
+                publication,
+                rdflib.URIRef("http://www.cidoc-crm.org/cidoc-crm/P3_has_note"),
+                rdflib.Literal(f"reference {i}"),
+            )
+        )
+    output = tmp_path / "pubs.ndjson"
+
+    def export(**kwargs):
+        return asyncio.run(
+            wisskas.export.export(
+                f"{tmp_path}/api",
+                "/pubs",
+                "http://example.org/sparql",
+                page_size=2,
+                jobs=3,
+                httpx_args={"transport": sparql_transport(graph)},
+                **kwargs,
+            )
+        )
+
+    assert export(output=str(output)) == 4
+    lines = output.read_text().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [
+        f"http://ex/p{i}" for i in range(7)
+    ]
+    assert not (tmp_path / "pubs.ndjson.progress.json").exists()
+
+    # an export interrupted while writing the third page resumes there
+    complete = "".join(line + "\n" for line in lines[:4])
+    output.write_text(complete + lines[4][:5])
+    (tmp_path / "pubs.ndjson.progress.json").write_text(
+        json.dumps(
+            {"endpoint": "/pubs", "page_size": 2, "page": 2, "offset": len(complete)}
+        )
+    )
+    assert export(output=str(output), resume=True) == 2
+    assert output.read_text().splitlines() == lines
+
+    assert export() == 4
+    assert capsysbinary.readouterr().out.decode().splitlines() == lines
+
+    # a failed page stops the export, the pages queried ahead are awaited
+    page = wisskas.export.Exporter.page
+    pending = []
+
+    async def fail_second(self, number):
+        if number == 1:
+            raise httpx.ConnectError("triple store unreachable")
+        pending.append(asyncio.current_task())
+        await asyncio.sleep(0 if number == 0 else 60)
+        return await page(self, number)
+
+    async def failed_export():
+        with pytest.raises(httpx.ConnectError):
+            await wisskas.export.export(
+                f"{tmp_path}/api",
+                "/pubs",
+                "http://example.org/sparql",
+                page_size=2,
+                jobs=3,
+                httpx_args={"transport": sparql_transport(graph)},
+            )
+        return [task.cancelled() for task in pending]
+
+    monkeypatch.setattr(wisskas.export.Exporter, "page", fail_second)
+    assert asyncio.run(failed_export()) == [False, True]
+    assert capsysbinary.readouterr().out.decode().splitlines() == lines[:2]
+
+
+def test_cli_snapshot(tmp_path):
+    run_cli(
+        "endpoints",
+        *("-li", "publication/pubs", "publication_reference"),
+        *("-ii", "publication/pub", "id", "publication_reference"),
+        *("-ii", "publication/ref", "publication_reference", "publication_reference"),
+        *("-o", f"{tmp_path}/api", "--page-size", "4"),
+    )
+    graph = rdflib.Graph()
+    note = rdflib.URIRef("http://www.cidoc-crm.org/cidoc-crm/P3_has_note")
+    for i in range(5):
+        publication = rdflib.URIRef(f"http://ex/p{i}")
+        graph.add(
+            (
+                publication,
+                rdflib.RDF.type,
+                rdflib.URIRef("https://r11.eu/ns/spec/Publication"),
+            )
+        )
+        graph.add((publication, note, rdflib.Literal(f"reference {i}")))
+    directory = tmp_path / "static"
+
+    def snapshot(page_size=2):
+        return asyncio.run(
+            wisskas.snapshot.snapshot(
+                f"{tmp_path}/api",
+                "http://example.org/sparql",
+                str(directory),
+                page_size=page_size,
+                jobs=3,
+                httpx_args={"transport": sparql_transport(graph)},
+            )
+        )
+
+    assert snapshot() == (13, 13, 0)
+    page = json.loads((directory / "pubs/page/3.json").read_text())
+    assert page["total"] == 5 and page["pages"] == 3 and page["page"] == 3
+    assert [item["id"] for item in page["items"]] == ["http://ex/p4"]
+    # the item of /pub?id=http://ex/p1
+    item = json.loads((directory / "pub/http%3A%2F%2Fex%2Fp1.json").read_text())
+    assert item["publication_reference"] == "reference 1"
+    # items are queried a page of keys at a time, also by keys other than the root
+    item = json.loads((directory / "ref/reference%204.json").read_text())
+    assert item["publication_reference"] == "reference 4"
+    index = json.loads((directory / "index.json").read_text())
+    assert index["endpoints"] == {
+        "/pub": {"items": 5},
+        "/pubs": {"pages": 3, "size": 2, "total": 5},
+        "/ref": {"items": 5},
+    }
+    assert len(index["files"]) == 13
+
+    # only the files with changed content are rewritten
+    assert snapshot() == (13, 0, 0)
+    graph.set((rdflib.URIRef("http://ex/p1"), note, rdflib.Literal("changed")))
+    assert snapshot() == (13, 3, 1)
+    assert "changed" in (directory / "pubs/page/1.json").read_text()
+    assert (directory / "ref/changed.json").exists()
+
+    # the files of items and pages that no longer exist are removed
+    graph.remove((rdflib.URIRef("http://ex/p4"), None, None))
+    assert snapshot() == (10, 2, 3)
+    assert not (directory / "pubs/page/3.json").exists()
+    assert not (directory / "pub/http%3A%2F%2Fex%2Fp4.json").exists()
+
+    # pages have the page size of the generated endpoints by default
+    assert snapshot(page_size=None) == (9, 1, 1)
+    page = json.loads((directory / "pubs/page/1.json").read_text())
+    assert page["size"] == 4 and len(page["items"]) == 4
+
+
+def test_cli_endpoints_async(tmp_path, serve):
+    run_cli(
+        "endpoints",
+        *("-le", "gender/genders", "gender_label", "-ie", "religion/r", "id"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        *("--async", "--counts-endpoint"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "async def api_genders(params" in entrypoint
+    assert (
+        "return await SINGLE_FLIGHT.arun(key, adapter.aget_page, params)" in entrypoint
+    )
+    assert "async def api_r(id: str)" in entrypoint
+    assert "async def counts():" in entrypoint
+    assert "asyncio.gather(" in entrypoint
+    with serve(religions_graph()) as client:
+        assert client.get("/genders").json()["total"] == 2
+        item = client.get("/r", params={"id": "http://ex/r0"}).json()
+        assert item["religion_label"] == "religion 0"
+        assert client.get("/counts").json() == {"/genders": 2}
+
+
+def test_cli_endpoints_response_cache(tmp_path, serve, import_generated, monkeypatch):
+    run_cli(
+        "endpoints",
+        *("-le", "gender/genders", "gender_label", "-ie", "religion/r", "id"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+        *("--cache-ttl", "60", "--cache-size", "5"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "CACHE = ResponseCache(size=5, ttl=60.0)" in entrypoint
+    assert 'key = f"/genders?{params.model_dump_json()}"' in entrypoint
+    assert 'key = f"/r?id={id}"' in entrypoint
+    assert entrypoint.count("CACHE.set(key, response)") == 2
+    assert '@app.post("/cache/flush", include_in_schema=False)' in entrypoint
+    graph = religions_graph()
+    with serve(graph) as client:
+        assert client.get("/genders").json()["total"] == 2
+        graph.add((rdflib.URIRef("http://ex/g2"), rdflib.RDF.type, PROSOPOGRAPHY.C11))
+        assert client.get("/genders").json()["total"] == 2
+        # flushing is disabled without a token
+        assert client.post("/cache/flush").status_code == 403
+        monkeypatch.setenv("CACHE_FLUSH_TOKEN", "secret")
+        assert client.post("/cache/flush").status_code == 403
+        headers = {"Authorization": "Bearer wrong"}
+        assert client.post("/cache/flush", headers=headers).status_code == 403
+        assert client.get("/genders").json()["total"] == 2
+        headers = {"Authorization": "Bearer secret"}
+        assert client.post("/cache/flush", headers=headers).json() == {"flushed": True}
+        assert client.get("/genders").json()["total"] == 3
+
+    run_cli(
+        "endpoints",
+        *("-ie", "religion/r", "id", "-o", f"{tmp_path}/api", "-f"),
+        *("-a", "http://example.org/sparql", "--cache-ttl", "60"),
+        *("--cache-backend", "shared.caches:RedisCache"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "from shared.caches import RedisCache" in entrypoint
+    assert "CACHE = RedisCache(size=1024, ttl=60.0)" in entrypoint
+    assert "class ResponseCache" not in entrypoint
+
+    # async endpoint functions call a custom backend in a worker thread
+    (tmp_path / "blocking_cache.py").write_text(
+        "import asyncio\n"
+        "class BlockingCache:\n"
+        "    def __init__(self, size, ttl):\n"
+        "        self.entries = {}\n"
+        "    def check(self):\n"
+        "        try:\n"
+        "            asyncio.get_running_loop()\n"
+        "        except RuntimeError:\n"
+        "            return\n"
+        "        raise AssertionError('cache called on the event loop')\n"
+        "    def get(self, key):\n"
+        "        self.check()\n"
+        "        return self.entries.get(key)\n"
+        "    def set(self, key, response):\n"
+        "        self.check()\n"
+        "        self.entries[key] = response\n"
+        "    def clear(self):\n"
+        "        self.check()\n"
+        "        self.entries.clear()\n"
+    )
+    run_cli(
+        "endpoints",
+        *("-le", "gender/genders", "gender_label", "-ie", "religion/r", "id"),
+        *("-o", f"{tmp_path}/blocking", "-a", "http://example.org/sparql"),
+        *("--cache-ttl", "60", "--async"),
+        *("--cache-backend", "blocking_cache:BlockingCache"),
+    )
+    entrypoint = (tmp_path / "blocking.py").read_text()
+    assert entrypoint.count("await asyncio.to_thread(CACHE.get, key)") == 2
+    assert entrypoint.count("await asyncio.to_thread(CACHE.set, key, response)") == 2
+    with serve(religions_graph(), "blocking") as client:
+        assert client.get("/genders").json()["total"] == 2
+        assert client.get("/r", params={"id": "http://ex/r1"}).status_code == 200
+        assert client.get("/genders").json()["total"] == 2
+        cache = import_generated("blocking").CACHE
+        assert len(cache.entries) == 2
+        headers = {"Authorization": "Bearer secret"}
+        assert client.post("/cache/flush", headers=headers).json() == {"flushed": True}
+        assert cache.entries == {}
+
+
+def test_cli_endpoints_coalesce(tmp_path, import_generated):
+    """identical concurrent requests share one query"""
+    run_cli(
+        "endpoints",
+        *("-le", "gender/genders", "gender_label", "-ie", "religion/r", "id"),
+        *("-o", f"{tmp_path}/api", "-a", "http://example.org/sparql"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "return SINGLE_FLIGHT.run(key, adapter.get_page, params)" in entrypoint
+    assert (
+        'return SINGLE_FLIGHT.run(key, adapter.get_item, **{ "id": id})' in entrypoint
+    )
+
+    # run the generated SingleFlight class on its own
+    single_flight = import_generated("api").SingleFlight()
+    in_flight = threading.Event()
+    queries = []
+    responses = []
+
+    def query(page):
+        queries.append(page)
+        # answer once all requests wait for this query
+        assert in_flight.wait(timeout=10)
+        return [page]
+
+    def request():
+        responses.append(single_flight.run("/genders?1", query, 1))
+
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 10
+    while single_flight.metrics()["requests"] < 5:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    in_flight.set()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+    assert queries == [1]
+    assert responses == [[1]] * 5
+    assert single_flight.metrics() == {"requests": 5, "coalesced": 4, "in_flight": 0}
+
+    run_cli(
+        "endpoints",
+        *("-ie", "religion/r", "id", "-o", f"{tmp_path}/api", "-f"),
+        *("-a", "http://example.org/sparql", "--no-coalesce"),
+    )
+    entrypoint = (tmp_path / "api.py").read_text()
+    assert "SINGLE_FLIGHT" not in entrypoint
+    assert 'return adapter.get_item(**{ "id": id})' in entrypoint
@@ -0,0 +1,155 @@
+import pathlib
+import sys
+
+import pytest
+
+from wisskas.filter import (
+    CloneCache,
+    DummyRootPath,
+    ModelSizeError,
+    RecursiveReferenceError,
+    clone_include,
+    endpoint_exclude_fields,
+    endpoint_include_fields,
+)
+from wisskas.serialize import serialize_model, serialize_query
+from wisskas.wisski import WISSKI_TYPES, nest_paths, parse_pathbuilder_paths
+
+test_data_file = pathlib.Path("tests/data/releven_assertions_20240821.xml")
+
+
+def path_xml(id, group_id, path_array, fieldtype="", datatype_property="empty"):
+    return f"""<path>
+    <id>{id}</id>
+    <enabled>1</enabled>
+    <group_id>{group_id}</group_id>
+    <fieldtype>{fieldtype}</fieldtype>
+    <cardinality>-1</cardinality>
+    <path_array>{"".join(f"<x>{p}</x>" for p in path_array)}</path_array>
+    <datatype_property>{datatype_property}</datatype_property>
+    <is_group>{0 if fieldtype else 1}</is_group>
+    <name>{id}</name>
+</path>"""
+
+
+# two paths referencing the same entity from the same group
+pathbuilder = f"""<pathbuilderinterface>
+{path_xml("a", 0, ["A"])}
+{path_xml("a_b1", "a", ["A", "p1", "B"], "entity_reference")}
+{path_xml("a_b2", "a", ["A", "p2", "B"], "entity_reference")}
+{path_xml("b", 0, ["B"])}
+{path_xml("b_name", "b", ["B"], "string", "label")}
+{path_xml("b_c", "b", ["B", "p3", "C"])}
+{path_xml("b_c_name", "b_c", ["B", "p3", "C"], "string", "label")}
+</pathbuilderinterface>"""
+
+
+def clone_uncached(path, include, root_classname):
+    return clone_include(DummyRootPath(root_classname, path), root_classname, include)
+
+
+def assert_same_endpoint(a, b):
+    assert serialize_model(a) == serialize_model(b)
+    assert serialize_query(a) == serialize_query(b)
+
+
+def test_clone_cache_reuses_subtrees():
+    _root_types, paths = nest_paths(parse_pathbuilder_paths(pathbuilder, cache=False))
+    clone_cache = CloneCache()
+    cached = endpoint_include_fields(paths["a"], ["**"], "A", clone_cache)
+
+    # the fields of b are only cloned for the first reference
+    assert clone_cache.hits == 2
+    assert_same_endpoint(cached, clone_uncached(paths["a"], ["**"], "A"))
+
+
+def test_clone_cache_rebases_subtrees():
+    _root_types, paths = nest_paths(parse_pathbuilder_paths(pathbuilder, cache=False))
+    clone_cache = CloneCache()
+    first = endpoint_include_fields(paths["a"], ["**"], "A", clone_cache)
+    hits = clone_cache.hits
+    second = endpoint_include_fields(paths["a"], ["**"], "Other", clone_cache)
+
+    # all subtrees of the second endpoint are reused from the first, but renamed
+    assert clone_cache.hits == hits + len(paths["a"].fields)
+    assert second.fields["a_b1"] is not first.fields["a_b1"]
+    assert second.fields["a_b1"].fields["b_c"].binding.startswith("Other_")
+    assert_same_endpoint(second, clone_uncached(paths["a"], ["**"], "Other"))
+    assert_same_endpoint(first, clone_uncached(paths["a"], ["**"], "A"))
+
+
+# two entities referencing each other
+cyclic_pathbuilder = f"""<pathbuilderinterface>
+{path_xml("x", 0, ["X"])}
+{path_xml("x_name", "x", ["X"], "string", "label")}
+{path_xml("x_y", "x", ["X", "p1", "Y"], "entity_reference")}
+{path_xml("y", 0, ["Y"])}
+{path_xml("y_name", "y", ["Y"], "string", "label")}
+{path_xml("y_x", "y", ["Y", "p2", "X"], "entity_reference")}
+</pathbuilderinterface>"""
+
+
+def test_recursive_reference_reports_cycle():
+    _root_types, paths = nest_paths(
+        parse_pathbuilder_paths(cyclic_pathbuilder, cache=False)
+    )
+    with pytest.raises(RecursiveReferenceError) as e:
+        endpoint_exclude_fields(paths["x"], [], "X")
+    assert e.value.cycle == ["x", "x_y", "y_x", "x"]
+    assert "x -> x_y -> y_x -> x" in str(e.value)
+
+    # references back into the root are fine as long as none of their fields are used
+    endpoint = endpoint_include_fields(paths["x"], ["x_y.*"], "X")
+    assert endpoint.fields["x_y"].fields["y_x"].fields == {}
+
+
+def test_recursive_reference_cut_off():
+    _root_types, paths = nest_paths(
+        parse_pathbuilder_paths(cyclic_pathbuilder, cache=False)
+    )
+    endpoint = endpoint_exclude_fields(paths["x"], [], "X", CloneCache(), 1)
+    # x -> y -> x -> y, then the reference back to x is only returned as URI
+    innermost = endpoint.fields["x_y"].fields["y_x"].fields["x_y"].fields["y_x"]
+    assert innermost.fields == {}
+    assert innermost.type == WISSKI_TYPES["uri"]
+    assert_same_endpoint(
+        endpoint, endpoint_exclude_fields(paths["x"], [], "X", None, 1)
+    )
+
+
+def test_model_size_limit():
+    _root_types, paths = nest_paths(
+        parse_pathbuilder_paths(cyclic_pathbuilder, cache=False)
+    )
+    # x -> y -> x -> y -> x (cut off), with the name fields of x and y
+    endpoint_exclude_fields(paths["x"], [], "X", CloneCache(), 1, max_paths=9)
+    with pytest.raises(ModelSizeError, match="model of 'x' has more than 8 fields"):
+        endpoint_exclude_fields(paths["x"], [], "X", CloneCache(), 1, max_paths=8)
+
+    # cyclic references unroll into exponentially many fields
+    _root_types, paths = nest_paths(parse_pathbuilder_paths(test_data_file))
+    with pytest.raises(ModelSizeError):
+        endpoint_include_fields(paths["person"], ["**"], "Person", None, 1)
+
+
+def test_deeply_nested_groups():
+    depth = 500
+    nested = "".join(
+        path_xml(f"g{i}", f"g{i - 1}" if i else 0, [f"G{j}" for j in range(i + 1)])
+        for i in range(depth)
+    )
+    _root_types, paths = nest_paths(
+        parse_pathbuilder_paths(
+            f"<pathbuilderinterface>{nested}</pathbuilderinterface>", cache=False
+        )
+    )
+    # cloning must not recurse once per nesting level
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(depth // 2)
+    try:
+        endpoint = endpoint_exclude_fields(paths["g0"], [], "G")
+    finally:
+        sys.setrecursionlimit(limit)
+    for i in range(1, depth):
+        endpoint = endpoint.fields[f"g{i}"]
+    assert endpoint.fields == {}
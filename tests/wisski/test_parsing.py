@@ -1,15 +1,49 @@
 import pathlib
-from wisskas.wisski import nest_paths, parse_pathbuilder_paths
+from wisskas.string_utils import PathElement
+from wisskas.wisski import iterparse_paths, nest_paths, parse_pathbuilder_paths
 
 test_data_file = pathlib.Path("tests/data/releven_assertions_20240821.xml")
 
 
 def test_parse_pathbuilder_paths():
-    # TODO test parsing from string
-    # parse_pathbuilder_paths("<foo />")
     # test parsing from file
-    parse_pathbuilder_paths(test_data_file)
+    paths = parse_pathbuilder_paths(test_data_file)
+    # test parsing from string
+    assert parse_pathbuilder_paths(test_data_file.read_text()).keys() == paths.keys()
+
+
+def test_parse_pathbuilder_paths_xml_retention():
+    assert all(
+        path.xml is None for path in parse_pathbuilder_paths(test_data_file).values()
+    )
+    paths = parse_pathbuilder_paths(test_data_file, keep_xml=True)
+    assert paths["person"].xml.findtext("id") == "person"
+
+
+def test_iterparse_paths():
+    paths = list(iterparse_paths(test_data_file, include_disabled=True))
+    assert len(paths) == len(
+        parse_pathbuilder_paths(test_data_file, include_disabled=True)
+    )
+    assert len(paths) > len(parse_pathbuilder_paths(test_data_file))
 
 
 def test_nest_paths():
     nest_paths(parse_pathbuilder_paths(test_data_file))
+
+
+def test_compact_paths():
+    paths = parse_pathbuilder_paths(test_data_file)
+    assert not hasattr(paths["person"], "__dict__")
+    # path elements are interned and shared between paths
+    assert paths["person"].path_array[0] is paths["person_id_assignment"].path_array[0]
+    assert PathElement("^foo#!") is PathElement("^foo#!")
+    assert PathElement("^foo#!") == PathElement("^foo")
+
+
+def test_path_elements_are_released():
+    """interned path elements are not kept alive once they are not used anymore"""
+    element = PathElement("^http://example.org/released")
+    assert "^http://example.org/released" in PathElement._interned
+    del element
+    assert "^http://example.org/released" not in PathElement._interned
@@ -0,0 +1,164 @@
+import os
+import pathlib
+import random
+
+import pytest
+import rdflib
+
+from wisskas.filter import endpoint_include_fields
+from wisskas.query import (
+    Pattern,
+    Query,
+    nested,
+    optimize,
+    query_patterns,
+    required_triples,
+)
+from wisskas.serialize import render_query, serialize_query
+from wisskas.string_utils import PathElement
+from wisskas.wisski import nest_paths, parse_pathbuilder_paths
+
+golden_dir = pathlib.Path("tests/data/queries")
+
+prefixes = {"crm": "http://www.cidoc-crm.org/cidoc-crm/"}
+
+# endpoint name: (path id, include fields)
+endpoints = {
+    "boulloterion": ("boulloterion", ["%", "boulloterion_seal_assertion.*"]),
+    "person": ("person", ["*"]),
+    "pubs": ("publication", ["%%"]),
+}
+
+
+@pytest.fixture(scope="module")
+def paths():
+    return nest_paths(
+        parse_pathbuilder_paths(
+            pathlib.Path("tests/data/releven_assertions_20240821.xml"), cache=False
+        )
+    )[1]
+
+
+def endpoint(paths, name):
+    path_id, include = endpoints[name]
+    return endpoint_include_fields(paths[path_id], include, name.title())
+
+
+def assert_golden(filename: str, query: str):
+    """Compare a query with its golden file, set $WISSKAS_UPDATE_GOLDEN to rewrite it"""
+    golden = golden_dir / filename
+    if os.environ.get("WISSKAS_UPDATE_GOLDEN"):
+        golden.write_text(query)
+    assert query == golden.read_text()
+
+
+def instantiate(graph: rdflib.Graph, pattern: Pattern, rng: random.Random, binding={}):
+    """Add random matches of pattern to graph: nested patterns are matched zero to two
+    times, and a few required triples are left out so some matches are incomplete"""
+    binding = dict(binding)
+
+    def node(variable):
+        return binding.setdefault(
+            variable, rdflib.URIRef(f"urn:{variable}:{rng.randrange(1 << 32)}")
+        )
+
+    for subject, predicate, object in required_triples(pattern):
+        if rng.random() < 0.02:
+            continue
+        if predicate is None:
+            graph.add((node(subject), rdflib.RDF.type, rdflib.URIRef(object.entity)))
+        elif predicate.inverted:
+            graph.add((node(object), rdflib.URIRef(predicate.entity), node(subject)))
+        else:
+            graph.add((node(subject), rdflib.URIRef(predicate.entity), node(object)))
+    for child in nested(pattern):
+        for arm in child.children if child.kind == "union" else [child]:
+            for _ in range(rng.choice([0, 1, 1, 2])):
+                instantiate(graph, arm, rng, binding)
+
+
+def results(graph: rdflib.Graph, query: str) -> list[tuple]:
+    result = graph.query(query)
+    return sorted(
+        tuple("" if row[v] is None else str(row[v]) for v in result.vars)
+        for row in result
+    )
+
+
+def assert_equivalent(query: Query, unoptimized: str, optimized: str, roots=3):
+    graph = rdflib.Graph()
+    rng = random.Random(0)
+    for _ in range(roots):
+        instantiate(graph, query.where, rng)
+    expected = results(graph, unoptimized)
+    assert expected
+    assert results(graph, optimized) == expected
+
+
+@pytest.mark.parametrize("name", endpoints)
+@pytest.mark.parametrize("roots", [None, "count", "ids"])
+def test_optimized_queries_are_equivalent(paths, name, roots):
+    root = endpoint(paths, name)
+    suffix = f".{roots}.rq" if roots else ".rq"
+    unoptimized = serialize_query(root, prefixes, roots)
+    optimized = serialize_query(root, prefixes, roots, optimized=True)
+    # the unoptimized queries are the ones written before the optimizer existed
+    assert_golden(f"{name}{suffix}", unoptimized)
+    assert_golden(f"{name}.optimized{suffix}", optimized)
+    assert_equivalent(query_patterns(root, roots), unoptimized, optimized)
+
+
+def test_optimize_hoists_required_patterns(paths):
+    query = optimize(query_patterns(endpoint(paths, "boulloterion")))
+    kinds = [child.kind for child in query.where.children]
+    assert kinds.index("optional") > len(kinds) - kinds[::-1].index("group") - 1
+    assert not any("^" in str(p) for _, p, _ in required_triples(query.where) if p)
+
+
+A = PathElement("urn:A")
+p = PathElement("urn:p")
+q = PathElement("urn:q")
+r = PathElement("urn:r")
+
+
+def example_query(*children):
+    return Query(
+        [(1, "a"), (2, "b"), (2, "c"), (2, "d")],
+        Pattern("group", [("a", None, A)], list(children)),
+    )
+
+
+def test_optimize_merges_optionals():
+    def query():
+        return example_query(
+            Pattern("optional", [("a", p, "b")]),
+            Pattern("optional", [("a", p, "b"), ("b", q, "c")]),
+            Pattern("optional", [("a", None, A), ("a", r, "d")]),
+        )
+
+    optimized = optimize(query())
+    # the type pattern is already required by the enclosing group
+    assert [c.triples for c in optimized.where.children] == [
+        [("a", p, "b")],
+        [("a", r, "d")],
+    ]
+    assert optimized.where.children[0].children[0].triples == [("b", q, "c")]
+    assert_equivalent(query(), render_query(query()), render_query(optimized), 20)
+
+
+def test_optimize_keeps_optionals_joined_on_other_variables():
+    def query():
+        return example_query(
+            Pattern("optional", [("a", p, "b")]),
+            Pattern("optional", [("a", p, "b"), ("b", q, "c")]),
+            Pattern("optional", [("a", r, "c")]),
+            Pattern(
+                "optional", [("a", None, A)], [Pattern("optional", [("a", q, "d")])]
+            ),
+        )
+
+    optimized = optimize(query())
+    # ?c is shared with the third OPTIONAL, and without its type pattern the last
+    # OPTIONAL would be empty apart from its nested OPTIONAL
+    assert [len(c.triples) for c in optimized.where.children] == [1, 2, 1, 1]
+    assert_equivalent(query(), render_query(query()), render_query(optimized), 20)
@@ -0,0 +1,35 @@
+import pytest
+
+from wisskas.filter import endpoint_include_fields
+from wisskas.synthetic import generate_pathbuilder
+from wisskas.wisski import parse_paths
+
+
+def test_generate_pathbuilder_deterministic():
+    xml = generate_pathbuilder(root_types=5, seed=1)
+    assert xml == generate_pathbuilder(root_types=5, seed=1)
+    assert xml != generate_pathbuilder(root_types=5, seed=2)
+
+
+def test_generate_pathbuilder_shape():
+    root_types, paths = parse_paths(
+        generate_pathbuilder(root_types=3, depth=2, fan_out=2, fields=4).decode(),
+        cache=False,
+    )
+    assert len(root_types) == 3
+    # (1 + 2 + 4) groups per root type with 1 + 4 paths each
+    assert len(paths) == 3 * 7 * 5
+
+
+def test_generate_pathbuilder_acyclic():
+    root_types, _paths = parse_paths(
+        generate_pathbuilder(root_types=8, references=0.5, cycles=False).decode(),
+        cache=False,
+    )
+    for path in root_types.values():
+        endpoint_include_fields(path, ["**"], "Endpoint", max_paths=None)
+
+
+def test_generate_pathbuilder_invalid():
+    with pytest.raises(ValueError):
+        generate_pathbuilder(depth=-1)